@@ -0,0 +1,225 @@
+# Benchmark du dashboard sur des guildes synthétiques (100 à 50 000 membres, sous-ensembles aléatoires des métiers).
+# Étapes mesurées, côté bot :
+#   roster  : DB.roster, agrégation Python de toutes les lignes (membre, métier) de la guilde
+#   page    : DB.roster_page sans filtre, cache vide (comptage, page, regroupement par membre)
+#   filtre  : DB.roster_page filtré sur un métier, cache vide
+#   rendu   : construction de l'embed d'une page (cache roster chaud), pseudos et display_metier
+# Postgres est simulé par des listes pré-triées : les temps mesurent le code Python du bot, pas le SQL.
+# Usage :
+#   python bench/bench_dashboard.py [--sizes 100,1000,10000,50000] [--duration 1] [--repeats 5] [--seed 42]
+#   python bench/bench_dashboard.py --save bench/baseline.json
+#   python bench/bench_dashboard.py --compare bench/baseline.json [--tolerance 0.25]
+# Chaque étape est mesurée --repeats fois (passes entrelacées, --duration réparti entre elles) et on garde
+# la médiane de chaque statistique : une passe perturbée (GC, autre processus) ne fausse pas le résultat.
+# Avec --compare, le code de sortie vaut 1 si un p50 régresse de plus de --tolerance.
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from contextlib import asynccontextmanager
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import bot_metiers as bm  # noqa: E402
+
+JOBS = [normed for _, normed in bm.METIER_LABELS]
+MISSING_NAME_RATIO = 0.1  # part des membres sans pseudo en base : résolus via guild.get_member au rendu
+
+class FakeMember:
+    def __init__(self, user_id: int, display_name: str):
+        self.id = user_id
+        self.display_name = display_name
+
+class FakeGuild:
+    # Ce que le rendu lit d'une discord.Guild : id et cache membres
+    def __init__(self, guild_id: int, members: dict[int, FakeMember]):
+        self.id = guild_id
+        self._members = members
+
+    def get_member(self, user_id: int):
+        return self._members.get(user_id)
+
+class SyntheticGuild:
+    # Guilde générée + réponses pré-calculées aux requêtes du bot
+    def __init__(self, guild_id: int, size: int, rng: random.Random):
+        self.id = guild_id
+        self.rows = []  # lignes de DB.roster : une par (membre, métier)
+        members = {}
+        per_member = {}
+        for user_id in range(1, size + 1):
+            display_name = None if rng.random() < MISSING_NAME_RATIO else f"Membre {user_id}"
+            dofus_name = f"Perso{user_id}" if rng.random() < 0.5 else None
+            jobs = sorted(((job, rng.randint(1, 200)) for job in rng.sample(JOBS, rng.randint(1, len(JOBS)))),
+                          key=lambda r: (-r[1], r[0]))
+            members[user_id] = FakeMember(user_id, f"Membre {user_id}")
+            avg = sum(lvl for _, lvl in jobs) / len(jobs)
+            per_member[user_id] = (display_name, dofus_name, jobs, avg)
+            for job, level in jobs:
+                self.rows.append({"user_id": user_id, "display_name": display_name, "dofus_name": dofus_name,
+                                  "job_name": job, "level": level})
+        self.guild = FakeGuild(guild_id, members)
+        self.members = per_member
+        # Équivalents des index member_stats_rank_idx et jobs_job_level_idx
+        self.ranking = sorted(per_member, key=lambda uid: (-per_member[uid][3], uid))
+        self.by_job: dict[str, list[tuple[int, int]]] = {job: [] for job in JOBS}
+        for user_id, (_, _, jobs, _) in per_member.items():
+            for job, level in jobs:
+                self.by_job[job].append((user_id, level))
+        for ranked in self.by_job.values():
+            ranked.sort(key=lambda r: (-r[1], r[0]))
+
+    def count(self, job_filter: str | None) -> int:
+        return len(self.ranking) if job_filter is None else len(self.by_job.get(job_filter, ()))
+
+    def page_rows(self, job_filter: str | None, offset: int, limit: int):
+        rows = []
+        if job_filter is None:
+            for user_id in self.ranking[offset:offset + limit]:
+                display_name, dofus_name, jobs, avg = self.members[user_id]
+                rows.extend({"user_id": user_id, "avg": avg, "display_name": display_name, "dofus_name": dofus_name,
+                             "job_name": job, "level": level} for job, level in jobs)
+            return rows
+        for user_id, level in self.by_job.get(job_filter, ())[offset:offset + limit]:
+            display_name, dofus_name, _, avg = self.members[user_id]
+            rows.append({"user_id": user_id, "avg": avg, "display_name": display_name, "dofus_name": dofus_name,
+                         "job_name": job_filter, "level": level})
+        return rows
+
+class FakeConn:
+    # Répond aux requêtes de DB (stockage "rows") d'après leurs paramètres, sans regarder le SQL
+    def __init__(self, guilds: dict[int, SyntheticGuild]):
+        self.guilds = guilds
+
+    async def fetch(self, query, *args):
+        guild = self.guilds[args[0]]
+        if len(args) == 1:
+            return guild.rows
+        return guild.page_rows(args[3] if len(args) > 3 else None, args[2], args[1])
+
+    async def fetchval(self, query, *args):
+        return self.guilds[args[0]].count(args[1] if len(args) > 1 else None)
+
+class BenchDB(bm.DB):
+    def __init__(self, guilds: dict[int, SyntheticGuild]):
+        super().__init__("postgresql://bench")
+        self._conn = FakeConn(guilds)
+
+    @asynccontextmanager
+    async def _acquire(self):
+        yield self._conn
+
+    async def set_display_names(self, names):
+        pass
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+async def measure(func, duration: float, min_calls: int = 5) -> dict:
+    # Appels répétés pendant `duration` s (au moins `min_calls`) ; func(i) -> coroutine
+    timings = []
+    start = time.perf_counter()
+    i = 0
+    while i < min_calls or time.perf_counter() - start < duration:
+        t0 = time.perf_counter()
+        await func(i)
+        timings.append(time.perf_counter() - t0)
+        i += 1
+    timings.sort()
+    return {"ops": len(timings) / sum(timings), "p50_us": percentile(timings, 0.5) * 1e6,
+            "p99_us": percentile(timings, 0.99) * 1e6, "calls": len(timings)}
+
+def median_of(runs: list[dict]) -> dict:
+    return {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+
+async def bench_size(size: int, duration: float, repeats: int, seed: int) -> dict[str, dict]:
+    rng = random.Random(seed + size)
+    guild = SyntheticGuild(10_000 + size, size, rng)
+    db = BenchDB({guild.id: guild})
+    bm.db = db  # le rendu passe par le `db` du module
+    pages = max(1, -(-size // bm.CARDS_PER_PAGE))
+    # Pages et filtres tirés à l'avance : même suite d'appels d'une exécution à l'autre
+    picks = [(rng.randrange(pages), rng.choice(JOBS)) for _ in range(1024)]
+
+    async def roster(i):
+        db.cache.clear()
+        await db.roster(guild.id)
+
+    async def page(i):
+        db.cache.clear()
+        await db.roster_page(guild.id, picks[i % len(picks)][0])
+
+    async def filtre(i):
+        db.cache.clear()
+        p, job = picks[i % len(picks)]
+        await db.roster_page(guild.id, p * len(guild.by_job[job]) // size, job)
+
+    async def rendu(i):
+        p, job = picks[i % len(picks)]
+        await bm._build_dashboard_embed(guild.guild, p, job if i % 2 else None)
+
+    stages = (("roster", roster), ("page", page), ("filtre", filtre), ("rendu", rendu))
+    runs: dict[str, list[dict]] = {name: [] for name, _ in stages}
+    for _ in range(repeats):
+        for name, func in stages:
+            if name == "rendu":
+                for i in range(len(picks)):  # cache roster chaud : seul le rendu est mesuré
+                    await rendu(i)
+            runs[name].append(await measure(func, duration / repeats))
+    return {name: median_of(stage_runs) for name, stage_runs in runs.items()}
+
+def fmt_us(us: float) -> str:
+    return f"{us / 1000:.2f} ms" if us >= 1000 else f"{us:.1f} µs"
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark du dashboard sur des guildes synthétiques")
+    parser.add_argument("--sizes", default="100,1000,10000,50000", help="tailles de guilde, séparées par des virgules")
+    parser.add_argument("--duration", type=float, default=1.0, help="durée de mesure par étape et par taille (s)")
+    parser.add_argument("--repeats", type=int, default=5, help="passes par étape, médiane retenue")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--save", metavar="FICHIER", help="enregistrer les résultats comme référence (JSON)")
+    parser.add_argument("--compare", metavar="FICHIER", help="comparer à une référence enregistrée avec --save")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="régression tolérée sur le p50 (0.25 = +25 %%)")
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+
+    async def run():
+        out = {}
+        for size in (int(s) for s in args.sizes.split(",")):
+            for stage, res in (await bench_size(size, args.duration, max(1, args.repeats), args.seed)).items():
+                out[f"{size}/{stage}"] = res
+        return out
+
+    results = asyncio.run(run())
+    regressions = 0
+    header = f"{'membres':>8} {'étape':<8}{'ops/s':>12}{'p50':>12}{'p99':>12}"
+    print(header + (f"{'Δ p50':>10}" if baseline else ""))
+    for key, res in results.items():
+        size, stage = key.split("/")
+        line = f"{size:>8} {stage:<8}{res['ops']:>12.0f}{fmt_us(res['p50_us']):>12}{fmt_us(res['p99_us']):>12}"
+        ref = baseline.get(key)
+        if ref:
+            delta = res["p50_us"] / ref["p50_us"] - 1
+            flag = " !" if delta > args.tolerance else ""
+            regressions += bool(flag)
+            line += f"{delta:>+9.0%}{flag}"
+        print(line)
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({"python": platform.python_version(), "seed": args.seed, "repeats": args.repeats, "results": results}, f, indent=2)
+        print(f"Référence enregistrée dans {args.save}")
+    if regressions:
+        print(f"{regressions} régression(s) au-delà de {args.tolerance:.0%} sur le p50")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+# Micro-benchmark de la normalisation des noms de métiers.
+# Compare l'ancienne version (14 str.replace enchaînés) à norm() (table de traduction + mémo).
+# Usage : python bench/bench_norm.py [nb_iterations]
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import bot_metiers as bm  # noqa: E402
+
+def norm_replace(s: str) -> str:
+    # Implémentation d'origine, gardée ici comme référence
+    s = s.lower().strip()
+    for a, b in bm.ACCENT_MAP.items():
+        s = s.replace(a, b)
+    return s
+
+def norm_uncached(s: str) -> str:
+    return bm.norm.__wrapped__(s)
+
+# Mélange réaliste : libellés accentués, clés déjà normalisées (lecture en base), saisies libres
+SAMPLES = [nom for nom, _ in bm._EMOJI_METIERS_RAW] + list(bm.EMOJI_BY_METIER) + ["  Bûcheron ", "FAÇONNEUR", "Pêcheur"]
+
+def run(func, number: int) -> float:
+    return min(timeit.repeat(lambda: [func(x) for x in SAMPLES], number=number, repeat=5))
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    for x in SAMPLES:
+        assert bm.norm(x) == norm_replace(x), x
+    calls = number * len(SAMPLES)
+    base = run(norm_replace, number)
+    print(f"{'version':<22}{'ns/appel':>10}{'gain':>8}")
+    for label, func in (("str.replace x14", norm_replace), ("translate", norm_uncached), ("translate + mémo", bm.norm)):
+        t = base if func is norm_replace else run(func, number)
+        print(f"{label:<22}{t / calls * 1e9:>10.1f}{base / t:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,31 @@
 import os
+import re
+import csv
+import io
+import gzip
+import json
+import hashlib
+import uuid
+import tempfile
 import math
+import time
+import asyncio
+import heapq
 import logging
-from functools import partial
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from contextvars import Context, ContextVar
+import unicodedata
+from functools import lru_cache, partial, wraps
+import aiohttp
+from aiohttp import web
 import asyncpg
+try:
+    import aiosqlite  # optionnel : STORAGE_BACKEND=sqlite
+except ImportError:
+    aiosqlite = None
 import discord
 from discord import app_commands
 from typing import List
@@ -17,108 +40,1050 @@ log = logging.getLogger("metiers")
 GUILD_ROLES_CAN_EDIT_OTHERS = {"Lead", "Murmureur"}
 DASHBOARD_TITLE = "⚒️ Métiers & Niveaux de la Guilde"
 CARDS_PER_PAGE = 6  # nb de cartes par page
-def norm(s: str) -> str:
-    s = s.lower().strip()
-    for a,b in ACCENT_MAP.items():
-        s = s.replace(a,b)
-    return s
+# Cache roster en mémoire : nb max de guildes gardées + plafond global de lignes métier (≈ mémoire)
+ROSTER_CACHE_MAX_GUILDS = int(os.getenv("ROSTER_CACHE_MAX_GUILDS", "500"))
+ROSTER_CACHE_MAX_ROWS = int(os.getenv("ROSTER_CACHE_MAX_ROWS", "200000"))
+# Rafraîchissement du dashboard après écriture : délai de calme (s) et retard max (s)
+DASHBOARD_REFRESH_DEBOUNCE = float(os.getenv("DASHBOARD_REFRESH_DEBOUNCE", "2"))
+DASHBOARD_REFRESH_MAX_DELAY = float(os.getenv("DASHBOARD_REFRESH_MAX_DELAY", "10"))
+# Temps de rendu (s) au-delà duquel un clic est d'abord acquitté par defer (Discord coupe à 3 s)
+INTERACTION_RENDER_BUDGET = float(os.getenv("INTERACTION_RENDER_BUDGET", "2"))
+# Limite d'edits de messages par salon côté Discord (≈ 5 toutes les 5 s) : EDIT_RATE edits par EDIT_PER s
+EDIT_RATE = int(os.getenv("EDIT_RATE", "5"))
+EDIT_PER = float(os.getenv("EDIT_PER", "5"))
+# Cache des pages rendues : nb max d'entrées + durée de vie (s), qui borne la fraîcheur des pseudos Discord
+RENDER_CACHE_MAX = int(os.getenv("RENDER_CACHE_MAX", "2000"))
+RENDER_CACHE_TTL = float(os.getenv("RENDER_CACHE_TTL", "300"))
+# Mode passerelle allégé : ni intent members ni message_content, aucun membre en cache ni chunking au démarrage.
+# Les pseudos des membres affichés sont alors demandés à la passerelle par lots et gardés dans un LRU borné.
+LEAN_GATEWAY = os.getenv("LEAN_GATEWAY", "0") == "1"
+MEMBER_NAME_CACHE_MAX = int(os.getenv("MEMBER_NAME_CACHE_MAX", "5000"))
+MEMBER_NAME_CACHE_TTL = float(os.getenv("MEMBER_NAME_CACHE_TTL", "900"))
+# Pseudos Discord recopiés dans profiles.display_name : écriture groupée toutes les N s, ou dès N pseudos en attente
+DISPLAY_NAME_FLUSH_INTERVAL = float(os.getenv("DISPLAY_NAME_FLUSH_INTERVAL", "5"))
+DISPLAY_NAME_BATCH = int(os.getenv("DISPLAY_NAME_BATCH", "500"))
+# Stockage : "postgres" (asyncpg, DATABASE_URL), "sqlite" (aiosqlite, fichier SQLITE_PATH, petites guildes
+# auto-hébergées) ou "memory" (rien n'est persisté : essais, benchmarks)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "postgres")
+SQLITE_PATH = os.getenv("SQLITE_PATH", "metiers.db")
+# Stockage Postgres des niveaux : "rows" (une ligne par métier dans `jobs`) ou "wide" (un tableau par membre dans `profiles`)
+STORAGE_LAYOUT = os.getenv("STORAGE_LAYOUT", "rows")
+# Passage de "rows" à "wide" : WIDE_MIGRATION_BACKUP=1 copie d'abord `jobs` dans jobs_rows_backup (à supprimer à la main)
+WIDE_MIGRATION_BACKUP = os.getenv("WIDE_MIGRATION_BACKUP", "0") == "1"
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", "2000000"))  # taille max d'un fichier /metier_import
+EXPORT_SPOOL_BYTES = int(os.getenv("EXPORT_SPOOL_BYTES", "1000000"))  # au-delà, l'export compressé passe sur disque
+
+# --- Pool Postgres ---
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "2"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_ACQUIRE_TIMEOUT = float(os.getenv("DB_ACQUIRE_TIMEOUT", "10"))  # attente max d'une connexion libre (s)
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", "30"))
+DB_MAX_INACTIVE_LIFETIME = float(os.getenv("DB_MAX_INACTIVE_LIFETIME", "300"))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))  # requêtes préparées gardées par connexion
+# "session" : Postgres direct ou pooler en mode session.
+# "transaction" : pooler en mode transaction (PgBouncer, Supavisor…) -> ni requêtes préparées nommées ni réglages de session.
+DB_POOLER_MODE = os.getenv("DB_POOLER_MODE", "session")
+DB_APPLICATION_NAME = os.getenv("DB_APPLICATION_NAME", "metiers-bot")
+MIGRATION_LOCK_ID = 0x6D657469  # verrou consultatif Postgres pris pendant les migrations
+# Les migrations passent par une connexion dédiée, hors pool : verrou consultatif de session, DDL longs.
+# Derrière un pooler en mode transaction, DB_MIGRATION_DSN (connexion directe) est obligatoire s'il reste des migrations.
+# DB_MIGRATION_TIMEOUT : délai max par instruction et pour l'attente du verrou (s), 0 = illimité.
+# Le verrou est attendu par pg_try_advisory_lock toutes les MIGRATION_LOCK_POLL s : entre deux essais,
+# l'instance en attente ne tient aucun snapshot qui bloquerait le CREATE INDEX CONCURRENTLY de celle qui migre.
+MIGRATION_LOCK_POLL = 0.5
+DB_MIGRATION_DSN = os.getenv("DB_MIGRATION_DSN")
+DB_MIGRATION_TIMEOUT = float(os.getenv("DB_MIGRATION_TIMEOUT", "0")) or None
+# Invalidation entre instances : les triggers publient chaque écriture sur ce canal (LISTEN/NOTIFY).
+# Derrière un pooler en mode transaction, LISTEN exige une connexion directe : DB_LISTEN_DSN.
+NOTIFY_CHANNEL = "metiers_roster"
+NOTIFY_ENABLED = os.getenv("NOTIFY_ENABLED", "1") == "1"
+DB_LISTEN_DSN = os.getenv("DB_LISTEN_DSN")
+INSTANCE_ID = os.getenv("INSTANCE_ID") or uuid.uuid4().hex[:8]  # doit être unique par processus
+
+# Synchro des slash commands : uniquement si l'arbre a changé (hash stocké en base).
+# DEV_GUILD_ID : synchro limitée à ce serveur de test (propagation immédiate) au lieu de la synchro globale.
+DEV_GUILD_ID = int(os.getenv("DEV_GUILD_ID", "0")) or None
+COMMANDS_FORCE_SYNC = os.getenv("COMMANDS_FORCE_SYNC", "0") == "1"
+
+# Endpoint HTTP de métriques (format texte Prometheus, /metrics, et /health). 0 = désactivé.
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")  # "0.0.0.0" pour un scrape depuis une autre machine
+# /health seul, joignable par la sonde de la plateforme (Railway fournit PORT) ; /metrics reste sur METRICS_HOST.
+# 0 = pas d'écoute séparée (/health reste servi avec /metrics).
+HEALTH_PORT = int(os.getenv("HEALTH_PORT") or os.getenv("PORT") or "0")
+HEALTH_HOST = os.getenv("HEALTH_HOST", "0.0.0.0")
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # secondes
+LOOP_LAG_INTERVAL = 1.0  # période de mesure du retard de la boucle asyncio (s)
+# Appels au stockage plus lents que DB_SLOW_QUERY_MS (ms) : loggés et gardés pour /db_slow.
+# Seuils par méthode : DB_SLOW_QUERY_THRESHOLDS="roster=500,export_csv=5000"
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "200"))
+DB_SLOW_QUERY_THRESHOLDS = {
+    name.strip(): float(ms) / 1000
+    for name, _, ms in (item.partition("=") for item in os.getenv("DB_SLOW_QUERY_THRESHOLDS", "").split(",") if "=" in item)
+}
+SLOW_QUERY_KEEP = int(os.getenv("SLOW_QUERY_KEEP", "50"))  # nb d'appels lents gardés depuis le démarrage
+# Traces (clic -> rendu -> stockage -> edit, slash commands) : "" = désactivé,
+# "file" = une ligne JSON par span dans TRACE_FILE, "otlp" = OpenTelemetry (paquets opentelemetry-sdk et
+# opentelemetry-exporter-otlp, configurés par les variables OTEL_EXPORTER_OTLP_* standard)
+TRACING = os.getenv("TRACING", "")
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+
+# Sharding : SHARD_COUNT = nb total de shards (vide = choisi par Discord), SHARD_IDS = shards gérés
+# par ce processus ("0-3" ou "0,2,4"). L'un des deux, ou SHARDED=1, active l'AutoShardedBot.
+def parse_shard_ids(raw: str) -> list[int] | None:
+    ids = []
+    for part in filter(None, (p.strip() for p in raw.split(","))):
+        lo, _, hi = part.partition("-")
+        ids.extend(range(int(lo), int(hi or lo) + 1))
+    return ids or None
+
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0")) or None
+SHARD_IDS = parse_shard_ids(os.getenv("SHARD_IDS", ""))
+if SHARD_IDS is not None and (SHARD_COUNT is None or max(SHARD_IDS) >= SHARD_COUNT):
+    # discord.py exige shard_count avec shard_ids, et chaque id doit être < shard_count
+    raise RuntimeError(f"SHARD_IDS={os.getenv('SHARD_IDS')} nécessite SHARD_COUNT supérieur au plus grand id (SHARD_COUNT={SHARD_COUNT})")
+SHARDED = os.getenv("SHARDED", "0") == "1" or SHARD_COUNT is not None or SHARD_IDS is not None
 
 ACCENT_MAP = {"é":"e","è":"e","ê":"e","à":"a","ù":"u","ô":"o","û":"u","î":"i","ï":"i","ç":"c","ä":"a","ë":"e","ö":"o","ü":"u"}
+_ACCENT_TABLE = str.maketrans(ACCENT_MAP)
+
+@lru_cache(maxsize=256)  # le vocabulaire des métiers est petit : quasi toujours un hit
+def norm(s: str) -> str:
+    s = s.lower().strip().translate(_ACCENT_TABLE)
+    if not s.isascii():
+        # Accent absent de la table : décomposition Unicode puis suppression des diacritiques
+        s = "".join(c for c in unicodedata.normalize("NFKD", s) if not unicodedata.combining(c))
+    return s
 
+# L'ordre sert d'index dans le tableau de niveaux du stockage "wide" : ajouter les nouveaux métiers à la fin
 _EMOJI_METIERS_RAW = [
     ("alchimiste", "🟢"), ("bûcheron", "🟢"), ("chasseur", "🟢"), ("mineur", "🟢"), ("paysan", "🟢"), ("pêcheur", "🟢"),
     ("bijoutier", "🔵"), ("joaillomage", "🔴"), ("cordonnier", "🔵"), ("cordomage", "🔴"), ("tailleur", "🔵"), ("costumage", "🔴"),
     ("forgeron", "🔵"), ("forgemage", "🔴"), ("façonneur", "🔵"), ("façomage", "🔴"), ("sculpteur", "🔵"), ("sculptemage", "🔴"), ("bricoleur", "🔵")
 ]
-EMOJI_BY_METIER = {norm(nom): emoji for nom, emoji in _EMOJI_METIERS_RAW}
-METIER_LABELS = [(nom, norm(nom)) for nom, _ in _EMOJI_METIERS_RAW]
 # Dictionnaire avec clés normalisées
 EMOJI_BY_METIER = {norm(nom): emoji for nom, emoji in _EMOJI_METIERS_RAW}
 # Pour affichage (label accentué -> clé normalisée)
 METIER_LABELS = [(nom, norm(nom)) for nom, _ in _EMOJI_METIERS_RAW]
-ACCENT_MAP = {"é":"e","è":"e","ê":"e","à":"a","ù":"u","ô":"o","û":"u","î":"i","ï":"i","ç":"c","ä":"a","ë":"e","ö":"o","ü":"u"}
-
-def norm(s: str) -> str:
-    s = s.lower().strip()
-    for a,b in ACCENT_MAP.items():
-        s = s.replace(a,b)
-    return s
+# Position (1-based, comme les tableaux Postgres) de chaque métier dans profiles.levels
+JOB_INDEX = {normed: i + 1 for i, (_, normed) in enumerate(METIER_LABELS)}
+ZERO_LEVELS = "{" + ",".join("0" * len(JOB_INDEX)) + "}"  # littéral Postgres : aucun métier
 
 def display_metier(name: str) -> str:
-    n = norm(name)
-    emoji = EMOJI_BY_METIER.get(n, "🛠️")
+    # Les noms venant de la base sont déjà normalisés (DB.set_job) : norm() seulement en secours
+    emoji = EMOJI_BY_METIER.get(name) or EMOJI_BY_METIER.get(norm(name), "🛠️")
     return f"{emoji} {name.capitalize()}"
 
 # INTENTS
 INTENTS = discord.Intents.default()
 INTENTS.guilds = True
-INTENTS.members = True
-INTENTS.message_content = True
+INTENTS.members = not LEAN_GATEWAY
+INTENTS.message_content = not LEAN_GATEWAY
+if LEAN_GATEWAY:
+    # Le bot ne lit aucun message ni événement de saisie/vocal : autant ne pas les recevoir
+    INTENTS.messages = False
+    INTENTS.typing = False
+    INTENTS.voice_states = False
+    INTENTS.invites = False
+
+class RosterCache:
+    # Cache LRU par guilde : guild_id -> {clé: (valeur, nb_lignes)}.
+    # Chaque écriture invalide la guilde et incrémente sa version : une lecture lancée
+    # avant l'écriture ne peut donc pas remettre en cache des données périmées.
+    def __init__(self, max_guilds: int = ROSTER_CACHE_MAX_GUILDS, max_rows: int = ROSTER_CACHE_MAX_ROWS):
+        self.max_guilds = max_guilds
+        self.max_rows = max_rows
+        self.rows = 0
+        self.hits = 0
+        self.misses = 0
+        self._guilds: OrderedDict[int, dict] = OrderedDict()
+        self._versions: dict[int, int] = {}
+
+    def version(self, guild_id: int) -> int:
+        return self._versions.get(guild_id, 0)
+
+    def get(self, guild_id: int, key):
+        entry = self._guilds.get(guild_id)
+        if entry is None or key not in entry:
+            self.misses += 1
+            return None
+        self._guilds.move_to_end(guild_id)
+        self.hits += 1
+        return entry[key][0]
+
+    def put(self, guild_id: int, key, value, rows: int, version: int):
+        if version != self.version(guild_id):
+            return  # une écriture est passée pendant la lecture
+        entry = self._guilds.setdefault(guild_id, {})
+        old = entry.get(key)
+        if old:
+            self.rows -= old[1]
+        entry[key] = (value, rows)
+        self.rows += rows
+        self._guilds.move_to_end(guild_id)
+        # Éviction des guildes les moins récemment consultées
+        while self._guilds and (len(self._guilds) > self.max_guilds or self.rows > self.max_rows):
+            _, evicted = self._guilds.popitem(last=False)
+            self.rows -= sum(r for _, r in evicted.values())
+
+    def invalidate(self, guild_id: int):
+        self._versions[guild_id] = self.version(guild_id) + 1
+        entry = self._guilds.pop(guild_id, None)
+        if entry:
+            self.rows -= sum(r for _, r in entry.values())
+
+    def clear(self):
+        for guild_id in set(self._versions) | set(self._guilds):
+            self.invalidate(guild_id)
+
+def concurrent_index(name: str, definition: str):
+    # Étape de migration : CREATE INDEX CONCURRENTLY, sans verrou bloquant les écritures.
+    # Un build interrompu laisse un index INVALID (maintenu à chaque écriture, jamais lu) : supprimé
+    # dès l'échec quand c'est possible, sinon au prochain démarrage, avant de reconstruire.
+    async def step(db, conn):
+        valid = await conn.fetchval("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass($1)", name)
+        if valid:
+            return
+        if valid is False:
+            await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+        try:
+            await conn.execute(f"CREATE INDEX CONCURRENTLY {name} {definition}")
+        except Exception:
+            if not conn.is_closed():
+                await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+            raise
+    step.concurrent = True
+    return step
+
+# --- Métriques ---
+# Séries en mémoire, rendues au format texte Prometheus à chaque lecture de /metrics.
+def _label_str(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    esc = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, esc)) + "}"
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, *labels, value: float = 1.0):
+        self.values[labels] = self.values.get(labels, 0.0) + value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for key, value in self.values.items():
+            yield f"{self.name}{_label_str(self.labels, key)} {value}"
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series: dict[tuple, list] = {}  # labels -> [compte par tranche..., somme, total]
+
+    def observe(self, value: float, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * len(self.buckets) + [0.0, 0]
+        i = bisect_left(self.buckets, value)
+        if i < len(self.buckets):
+            series[i] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def summary(self) -> dict[tuple, tuple[int, float]]:
+        # labels -> (nb d'observations, somme)
+        return {key: (series[-1], series[-2]) for key, series in self._series.items()}
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for key, series in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                yield f"{self.name}_bucket{_label_str(self.labels + ('le',), key + (bound,))} {cumulative}"
+            yield f"{self.name}_bucket{_label_str(self.labels + ('le',), key + ('+Inf',))} {series[-1]}"
+            yield f"{self.name}_sum{_label_str(self.labels, key)} {series[-2]}"
+            yield f"{self.name}_count{_label_str(self.labels, key)} {series[-1]}"
+
+class Collected:
+    # Valeurs lues au moment du scrape : collect() -> {(valeurs de labels): valeur}
+    def __init__(self, name: str, help: str, labels: tuple, collect, kind: str = "gauge"):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.collect = collect
+        self.kind = kind
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for key, value in self.collect().items():
+            yield f"{self.name}{_label_str(self.labels, key)} {value}"
+
+COMMAND_LATENCY = Histogram("metiers_command_seconds", "Durée des slash commands", ("command", "status"))
+COMPONENT_LATENCY = Histogram("metiers_component_seconds", "Durée des clics sur le dashboard", ("component", "status"))
+DB_LATENCY = Histogram("metiers_db_seconds", "Durée des appels au stockage", ("method",))
+REST_REQUESTS = Counter("metiers_discord_rest_requests_total", "Appels REST Discord", ("method", "route", "status"))
+REST_RATE_LIMIT_WAIT = Counter("metiers_discord_rate_limit_wait_seconds_total", "Attente demandée par les réponses 429", ("route",))
+LOOP_LAG = Histogram("metiers_event_loop_lag_seconds", "Retard de la boucle asyncio",
+                     buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5))
+METRICS = [COMMAND_LATENCY, COMPONENT_LATENCY, DB_LATENCY, REST_REQUESTS, REST_RATE_LIMIT_WAIT, LOOP_LAG]
+
+def render_metrics() -> str:
+    return "\n".join(line for metric in METRICS for line in metric.render()) + "\n"
+
+# --- Traces ---
+# span(nom, **attributs) s'utilise en `with` ; le span courant (ContextVar) devient le parent des suivants,
+# y compris dans les tâches créées pendant ce temps. Désactivé : un seul objet inerte partagé.
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, key: str, value):
+        pass
+
+    def activate(self):
+        pass
+
+    def end(self, error: BaseException | None = None):
+        pass
+
+_NOOP_SPAN = _NoopSpan()
+_CURRENT_SPAN: ContextVar["FileSpan | None"] = ContextVar("span", default=None)
+
+class FileSpan:
+    def __init__(self, tracer: "FileTracer", name: str, attrs: dict):
+        parent = _CURRENT_SPAN.get()
+        self.tracer = tracer
+        self.name = name
+        self.attrs = attrs
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent else None
+        self.start = time.time()
+        self._started = time.perf_counter()
+        self._token = None
+
+    def __enter__(self):
+        self._token = _CURRENT_SPAN.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _CURRENT_SPAN.reset(self._token)
+        self.end(exc)
+        return False
+
+    def set(self, key: str, value):
+        self.attrs[key] = value
+
+    def activate(self):
+        # Span ouvert hors d'un `with` (slash commands) : parent du reste de la tâche courante
+        _CURRENT_SPAN.set(self)
+
+    def end(self, error: BaseException | None = None):
+        self.tracer.export({
+            "name": self.name, "trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id,
+            "start": self.start, "duration_ms": round((time.perf_counter() - self._started) * 1000, 3),
+            "status": "error" if error else "ok", "error": repr(error) if error else None, "attributes": self.attrs,
+        })
+
+class FileTracer:
+    def __init__(self, path: str):
+        # Tamponné par ligne : chaque span est sur disque dès sa fin, même si le processus est tué
+        self._file = open(path, "a", encoding="utf-8", buffering=1)
+
+    def start(self, name: str, attrs: dict) -> FileSpan:
+        return FileSpan(self, name, attrs)
+
+    def export(self, record: dict):
+        self._file.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+
+    def close(self):
+        self._file.close()
+
+class OtelSpan:
+    def __init__(self, otel, name: str, attrs: dict):
+        self._otel = otel
+        self._span = otel.tracer.start_span(name, attributes={k: v for k, v in attrs.items() if v is not None})
+        self._token = None
+
+    def __enter__(self):
+        self._token = self._otel.context.attach(self._otel.trace.set_span_in_context(self._span))
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._otel.context.detach(self._token)
+        self.end(exc)
+        return False
+
+    def set(self, key: str, value):
+        if value is not None:
+            self._span.set_attribute(key, value)
+
+    def activate(self):
+        self._otel.context.attach(self._otel.trace.set_span_in_context(self._span))
+
+    def end(self, error: BaseException | None = None):
+        if error is not None:
+            self._span.record_exception(error)
+            self._span.set_status(self._otel.trace.Status(self._otel.trace.StatusCode.ERROR))
+        self._span.end()
+
+class OtelTracer:
+    # Export OTLP via le SDK OpenTelemetry (import optionnel)
+    def __init__(self):
+        from opentelemetry import context, trace
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        self.context = context
+        self.trace = trace
+        self.provider = TracerProvider(resource=Resource.create({"service.name": DB_APPLICATION_NAME, "service.instance.id": INSTANCE_ID}))
+        self.provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+        self.tracer = self.provider.get_tracer("metiers")
+
+    def start(self, name: str, attrs: dict) -> OtelSpan:
+        return OtelSpan(self, name, attrs)
+
+    def close(self):
+        self.provider.shutdown()
+
+def make_tracer():
+    if TRACING == "file":
+        return FileTracer(TRACE_FILE)
+    if TRACING == "otlp":
+        try:
+            return OtelTracer()
+        except ImportError as e:
+            log.warning("TRACING=otlp sans SDK OpenTelemetry (%s) : traces désactivées", e)
+            return None
+    if TRACING:
+        log.warning("TRACING inconnu : %s (attendu : file ou otlp)", TRACING)
+    return None
+
+tracer = make_tracer()
+
+def span(name: str, **attrs):
+    if tracer is None:
+        return _NOOP_SPAN
+    return tracer.start(name, attrs)
+
+def detached_task(coro) -> asyncio.Task:
+    # Tâche de fond qui survit à la requête qui la lance : contexte vide (ni span courant, ni
+    # contexte OpenTelemetry), sinon tout son travail serait rattaché à la trace de ce premier appel
+    return Context().run(asyncio.create_task, coro)
+
+# Appels lents depuis le démarrage, tas des SLOW_QUERY_KEEP plus longs :
+# (durée, n°, méthode, guild_id, lignes, attente connexion, horodatage)
+SLOW_QUERIES: list[tuple] = []
+_slow_seq = 0
+
+class CallStats:
+    # Temps passé à attendre une connexion du pool pendant un appel au stockage
+    __slots__ = ("acquire",)
+
+    def __init__(self):
+        self.acquire = 0.0
+
+_CALL_STATS: ContextVar[CallStats | None] = ContextVar("storage_call", default=None)
+
+def record_acquire_wait(seconds: float):
+    stats = _CALL_STATS.get()
+    if stats is not None:
+        stats.acquire += seconds
+
+def _row_count(result) -> int | None:
+    # Entrées renvoyées : liste (roster, métiers) ou tuple dont le 1er élément est la liste (pages)
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, tuple) and result and isinstance(result[0], list):
+        return len(result[0])
+    return None
+
+def _record_slow_call(name: str, args: tuple, result, elapsed: float, acquire: float):
+    global _slow_seq
+    guild_id = args[0] if args and isinstance(args[0], int) else None
+    rows = _row_count(result)
+    log.warning("Appel stockage lent : %s guild=%s lignes=%s %.0f ms (attente connexion %.0f ms, exécution %.0f ms)",
+                name, guild_id, rows, elapsed * 1000, acquire * 1000, (elapsed - acquire) * 1000)
+    _slow_seq += 1
+    entry = (elapsed, _slow_seq, name, guild_id, rows, acquire, time.time())
+    if len(SLOW_QUERIES) < SLOW_QUERY_KEEP:
+        heapq.heappush(SLOW_QUERIES, entry)
+    else:
+        heapq.heappushpop(SLOW_QUERIES, entry)
+
+def instrument_storage(storage):
+    # Chaque méthode listée dans Storage.TIMED_METHODS est chronométrée : DB_LATENCY (label = nom de la
+    # méthode) et, au-delà du seuil, log + SLOW_QUERIES. Les appels internes (roster_page -> _load_page)
+    # passent aussi par l'instance : cache et stockage sont distingués.
+    for name in storage.TIMED_METHODS:
+        setattr(storage, name, _timed_method(name, getattr(storage, name)))
+    return storage
+
+def _timed_method(name: str, method):
+    threshold = DB_SLOW_QUERY_THRESHOLDS.get(name, DB_SLOW_QUERY_MS / 1000)
+    span_name = f"storage.{name}"
+
+    @wraps(method)
+    async def timed(*args, **kwargs):
+        parent = _CALL_STATS.get()
+        stats = CallStats()
+        token = _CALL_STATS.set(stats)
+        started = time.perf_counter()
+        result = None
+        try:
+            with span(span_name) as sp:
+                result = await method(*args, **kwargs)
+                if tracer is not None:
+                    sp.set("guild_id", args[0] if args and isinstance(args[0], int) else None)
+                    sp.set("rows", _row_count(result))
+                    sp.set("acquire_ms", round(stats.acquire * 1000, 3))
+            return result
+        finally:
+            elapsed = time.perf_counter() - started
+            _CALL_STATS.reset(token)
+            if parent is not None:
+                parent.acquire += stats.acquire
+            DB_LATENCY.observe(elapsed, name)
+            if elapsed >= threshold:
+                _record_slow_call(name, args, result, elapsed, stats.acquire)
+    return timed
+
+class Storage(ABC):
+    # Interface commune des stockages (Postgres, SQLite, mémoire). Le cache roster, la pagination
+    # et la mémoire des dashboards sont partagés ; chaque stockage fournit les méthodes _load_* et les écritures.
+    # Toute écriture invalide la guilde dans self.cache.
+    TIMED_METHODS = (
+        "set_profile_name", "get_profile_name", "set_display_names", "set_job", "remove_job", "import_jobs",
+        "list_user_jobs", "export_csv", "get_meta", "set_meta", "roster", "roster_page", "get_dashboard",
+        "set_dashboard", "_load_roster", "_load_page", "_load_dashboard",
+    )
+    def __init__(self):
+        self.cache = RosterCache()
+        # ids (salon, message) du dashboard par guilde, lus une seule fois dans le stockage
+        self._dashboards: dict[int, tuple[int | None, int | None]] = {}
+
+    async def setup(self):
+        pass
+
+    async def listen(self, callback):
+        # Invalidation entre instances : seul Postgres partage ses données entre processus
+        pass
+
+    async def close(self):
+        pass
 
-class DB:
+    @abstractmethod
+    async def set_profile_name(self, guild_id: int, user_id: int, name: str):
+        ...
+
+    @abstractmethod
+    async def get_profile_name(self, guild_id: int, user_id: int):
+        ...
+
+    @abstractmethod
+    async def set_display_names(self, names: list[tuple[int, int, str]]):
+        ...
+
+    @abstractmethod
+    async def set_job(self, guild_id: int, user_id: int, job: str, level: int):
+        ...
+
+    @abstractmethod
+    async def remove_job(self, guild_id: int, user_id: int, job: str):
+        ...
+
+    @abstractmethod
+    async def import_jobs(self, guild_id: int, records: list[tuple[int, str, int]]):
+        ...
+
+    @abstractmethod
+    async def list_user_jobs(self, guild_id: int, user_id: int):
+        ...
+
+    @abstractmethod
+    async def export_csv(self, guild_id: int, output):
+        ...
+
+    @abstractmethod
+    async def get_meta(self, key: str):
+        ...
+
+    @abstractmethod
+    async def set_meta(self, key: str, value: str):
+        ...
+
+    @abstractmethod
+    async def _load_roster(self, guild_id: int):
+        # -> (roster, nb de lignes lues)
+        ...
+
+    @abstractmethod
+    async def _load_page(self, guild_id: int, page: int, job_filter: str | None, per_page: int):
+        # -> (chunk, total, page ramenée dans les bornes, nb de lignes lues)
+        ...
+
+    @abstractmethod
+    async def _load_dashboard(self, guild_id: int):
+        ...
+
+    @abstractmethod
+    async def _save_dashboard(self, guild_id: int, channel_id: int | None, message_id: int | None):
+        ...
+
+    async def roster(self, guild_id: int):
+        # Classement complet : [(uid, pseudo Discord, pseudo Dofus, [(métier, niveau)], moyenne)]
+        cached = self.cache.get(guild_id, "roster")
+        if cached is not None:
+            return cached
+        version = self.cache.version(guild_id)
+        result, rows = await self._load_roster(guild_id)
+        self.cache.put(guild_id, "roster", result, rows, version)
+        return result
+
+    async def roster_page(self, guild_id: int, page: int = 0, job_filter: str | None = None, per_page: int = CARDS_PER_PAGE):
+        # Une seule page du classement + nb total de profils. Sans filtre : tri par moyenne ;
+        # avec filtre : membres ayant ce métier, triés par leur niveau dans ce métier.
+        # Retourne (chunk, total, page) avec la page ramenée dans les bornes.
+        key = ("page", job_filter, page, per_page)
+        cached = self.cache.get(guild_id, key)
+        if cached is not None:
+            return cached
+        version = self.cache.version(guild_id)
+        chunk, total, page, rows = await self._load_page(guild_id, page, job_filter, per_page)
+        result = (chunk, total, page)
+        self.cache.put(guild_id, key, result, rows, version)
+        return result
+
+    @staticmethod
+    def _aggregate(rows):
+        # Lignes (membre, métier) dans le désordre -> classement complet trié par moyenne
+        data = {}
+        for r in rows:
+            lst = data.setdefault(r["user_id"], {"display": r["display_name"], "name": r["dofus_name"], "jobs": []})
+            lst["jobs"].append((r["job_name"], r["level"]))
+        result = []
+        for uid, info in data.items():
+            jobs = sorted(info["jobs"], key=lambda r: (-r[1], r[0]))
+            avg = sum(l for _, l in jobs) / len(jobs)
+            result.append((uid, info["display"], info["name"], jobs, avg))
+        result.sort(key=lambda x: (-x[4], x[0]))
+        return result
+
+    def _page_chunk(self, rows, job_filter: str | None):
+        # Lignes (membre, métier) triées -> [(uid, pseudo Discord, pseudo Dofus, [(métier, niveau)], moyenne)]
+        chunk = []
+        for r in rows:
+            if not chunk or chunk[-1][0] != r["user_id"]:
+                chunk.append((r["user_id"], r["display_name"], r["dofus_name"], [], r["avg"]))
+            chunk[-1][3].append((r["job_name"], r["level"]))
+        return chunk
+
+    @staticmethod
+    def _write_csv(rows, output):
+        # Même format que COPY ... CSV HEADER de Postgres (NULL -> champ vide), `output` binaire
+        buf = io.StringIO()
+        writer = csv.writer(buf, lineterminator="\n")
+        writer.writerow(("user_id", "dofus_name", "job_name", "level"))
+        writer.writerows(rows)
+        output.write(buf.getvalue().encode())
+
+    async def get_dashboard(self, guild_id: int):
+        cached = self._dashboards.get(guild_id)
+        if cached is not None:
+            return cached
+        result = await self._load_dashboard(guild_id)
+        self._dashboards[guild_id] = result
+        return result
+
+    async def forget_dashboard(self, guild_id: int):
+        # Message supprimé côté Discord : ids effacés en base aussi, plus de tentative d'edit
+        # (ni après un redémarrage) jusqu'au prochain /dashboard
+        await self.set_dashboard(guild_id, None, None)
+
+    async def set_dashboard(self, guild_id: int, channel_id: int | None, message_id: int | None):
+        await self._save_dashboard(guild_id, channel_id, message_id)
+        self._dashboards[guild_id] = (channel_id, message_id)
+
+class ExplainConn:
+    # Se substitue à une connexion asyncpg : chaque requête est passée à EXPLAIN (ANALYZE, BUFFERS)
+    # et son plan gardé dans self.plans ; fetch/fetchval ne renvoient rien d'utile.
+    def __init__(self, conn):
+        self.conn = conn
+        self.plans: list[str] = []
+
+    async def fetch(self, query, *args):
+        rows = await self.conn.fetch("EXPLAIN (ANALYZE, BUFFERS) " + query, *args)
+        self.plans.append("\n".join(r[0] for r in rows))
+        return []
+
+    fetchval = fetch
+
+class DB(Storage):
     def __init__(self, dsn: str | None = None):
+        super().__init__()
         self.dsn = dsn or os.getenv("DATABASE_URL")
-        if not self.dsn:
-            raise RuntimeError("DATABASE_URL manquante")
         self.pool: asyncpg.Pool | None = None
+        # Hooks appelés sur chaque nouvelle connexion du pool : async def hook(conn)
+        self.init_hooks: list = []
+        # Nom de session unique : les notifications venant de nos propres écritures sont reconnues
+        self.application_name = f"{DB_APPLICATION_NAME}-{INSTANCE_ID}"
+        self._listener: asyncpg.Connection | None = None
+        self._listen_callback = None
+
+    def add_init_hook(self, hook):
+        self.init_hooks.append(hook)
+
+    async def _init_connection(self, conn):
+        for hook in self.init_hooks:
+            await hook(conn)
+
+    @asynccontextmanager
+    async def _acquire(self):
+        started = time.perf_counter()
+        async with self.pool.acquire(timeout=DB_ACQUIRE_TIMEOUT) as conn:
+            record_acquire_wait(time.perf_counter() - started)
+            yield conn
 
     async def setup(self):
-        self.pool = await asyncpg.create_pool(self.dsn, min_size=1, max_size=5)
-        async with self.pool.acquire() as conn:
+        if not self.dsn:
+            raise RuntimeError("DATABASE_URL manquante")
+        transaction_pooler = DB_POOLER_MODE == "transaction"
+        server_settings = {"application_name": self.application_name}
+        if not transaction_pooler:
+            # Les requêtes du bot sont courtes : la compilation JIT coûte plus qu'elle ne rapporte
+            server_settings["jit"] = "off"
+        self.pool = await asyncpg.create_pool(
+            self.dsn,
+            min_size=DB_POOL_MIN,
+            max_size=DB_POOL_MAX,
+            command_timeout=DB_COMMAND_TIMEOUT,
+            max_inactive_connection_lifetime=DB_MAX_INACTIVE_LIFETIME,
+            # asyncpg réutilise les requêtes préparées par texte de requête (cache LRU par connexion) ;
+            # derrière un pooler en mode transaction, une connexion serveur peut changer à chaque transaction.
+            statement_cache_size=0 if transaction_pooler else DB_STATEMENT_CACHE_SIZE,
+            server_settings=server_settings,
+            init=self._init_connection,
+        )
+        await self.migrate()
+        if not transaction_pooler:
+            await self.warm_up()
+
+    async def warm_up(self):
+        # Ouvre les DB_POOL_MIN connexions et y prépare les requêtes chaudes du dashboard :
+        # le premier clic après un redémarrage ne paie ni connexion ni PREPARE.
+        conns = [await self.pool.acquire(timeout=DB_ACQUIRE_TIMEOUT) for _ in range(DB_POOL_MIN)]
+        try:
+            for conn in conns:
+                await self._count_members(conn, 0, None)
+                await self._count_members(conn, 0, "")
+                await self._fetch_page(conn, 0, 0, None, CARDS_PER_PAGE)
+                await self._fetch_page(conn, 0, 0, "", CARDS_PER_PAGE)
+        finally:
+            for conn in conns:
+                await self.pool.release(conn)
+        log.info("Pool Postgres prêt (%s-%s connexions, mode %s)", DB_POOL_MIN, DB_POOL_MAX, DB_POOLER_MODE)
+
+    async def migrate(self):
+        # Schéma versionné : chaque étape de MIGRATIONS est appliquée une seule fois (table schema_version).
+        # Schéma à jour (cas courant) : une seule requête, aucun DDL.
+        async with self._acquire() as conn:
+            applied = await self._applied_versions(conn)
+        # Base migrée par un autre stockage (ex. "wide" : `jobs` vidée, member_stats supprimée) : inutilisable ici
+        foreign = sorted(applied - {version for version, _, _ in self.MIGRATIONS})
+        if foreign:
+            raise RuntimeError(f"Base migrée vers un autre stockage (versions {foreign} inconnues de "
+                               f"{type(self).__name__}) : vérifier STORAGE_LAYOUT")
+        if not self._pending_migrations(applied):
+            return
+        if DB_POOLER_MODE == "transaction" and not DB_MIGRATION_DSN:
+            # Le verrou de session et CREATE INDEX CONCURRENTLY exigent de garder la même connexion serveur
+            raise RuntimeError("Migrations en attente : DB_MIGRATION_DSN (connexion directe à Postgres) "
+                               "est requise avec DB_POOLER_MODE=transaction")
+        # Connexion dédiée : pas de command_timeout du pool (backfill, index sur une grosse table),
+        # et le verrou de session est relâché par Postgres si le processus meurt en cours de route
+        conn = await asyncpg.connect(
+            DB_MIGRATION_DSN or self.dsn,
+            command_timeout=DB_MIGRATION_TIMEOUT,
+            server_settings={"application_name": f"{self.application_name}-migrate", "statement_timeout": "0"},
+        )
+        try:
+            await self._init_connection(conn)
+            # Un seul processus migre à la fois ; les autres attendent puis ne trouvent plus rien à faire
+            await self._lock_migrations(conn)
             await conn.execute("""
-            CREATE TABLE IF NOT EXISTS profiles(
-                guild_id BIGINT NOT NULL,
-                user_id  BIGINT NOT NULL,
-                dofus_name TEXT,
-                PRIMARY KEY (guild_id, user_id)
-            );
-            CREATE TABLE IF NOT EXISTS jobs(
-                guild_id BIGINT NOT NULL,
-                user_id  BIGINT NOT NULL,
-                job_name TEXT NOT NULL,
-                level    INT   NOT NULL,
-                PRIMARY KEY (guild_id, user_id, job_name)
-            );
-            CREATE TABLE IF NOT EXISTS settings(
-                guild_id BIGINT PRIMARY KEY,
-                dashboard_channel_id BIGINT,
-                dashboard_message_id BIGINT
-            );
+            CREATE TABLE IF NOT EXISTS schema_version(
+                version    INT PRIMARY KEY,
+                name       TEXT NOT NULL,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
             """)
+            for version, name, step in self._pending_migrations(await self._applied_versions(conn)):
+                log.info("Migration %s : %s", version, name)
+                if getattr(step, "concurrent", False):
+                    # CREATE INDEX CONCURRENTLY est interdit dans une transaction
+                    await step(self, conn)
+                    await conn.execute("INSERT INTO schema_version(version, name) VALUES($1,$2)", version, name)
+                    continue
+                async with conn.transaction():
+                    if callable(step):
+                        await step(self, conn)
+                    else:
+                        await conn.execute(step)
+                    await conn.execute("INSERT INTO schema_version(version, name) VALUES($1,$2)", version, name)
+        finally:
+            await conn.close()  # relâche aussi le verrou
+
+    @staticmethod
+    async def _lock_migrations(conn):
+        # Pas de pg_advisory_lock bloquant : la requête en attente garderait un snapshot ouvert, et la
+        # dernière phase d'un CREATE INDEX CONCURRENTLY attend toutes les transactions au snapshot plus
+        # ancien -> interblocage entre deux instances qui démarrent ensemble
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + DB_MIGRATION_TIMEOUT if DB_MIGRATION_TIMEOUT else None
+        while not await conn.fetchval("SELECT pg_try_advisory_lock($1)", MIGRATION_LOCK_ID):
+            if deadline is not None and loop.time() >= deadline:
+                raise RuntimeError("Verrou des migrations toujours tenu par une autre instance "
+                                   f"après {DB_MIGRATION_TIMEOUT:g} s (DB_MIGRATION_TIMEOUT)")
+            await asyncio.sleep(MIGRATION_LOCK_POLL)
+
+    async def _applied_versions(self, conn) -> set[int]:
+        try:
+            return {r["version"] for r in await conn.fetch("SELECT version FROM schema_version")}
+        except asyncpg.UndefinedTableError:
+            return set()
+
+    def _pending_migrations(self, applied: set[int]):
+        return [m for m in self.MIGRATIONS if m[0] not in applied]
+
+    # Étapes (version, nom, SQL ou coroutine(db, conn)), dans l'ordre. Ne jamais modifier une étape
+    # déjà déployée : en ajouter une nouvelle. Les étapes 1 à 3 sont idempotentes pour reprendre
+    # les bases créées avant le versionnage.
+    MIGRATIONS = [
+        (1, "tables de base", """
+        CREATE TABLE IF NOT EXISTS profiles(
+            guild_id BIGINT NOT NULL,
+            user_id  BIGINT NOT NULL,
+            dofus_name TEXT,
+            PRIMARY KEY (guild_id, user_id)
+        );
+        CREATE TABLE IF NOT EXISTS jobs(
+            guild_id BIGINT NOT NULL,
+            user_id  BIGINT NOT NULL,
+            job_name TEXT NOT NULL,
+            level    INT   NOT NULL,
+            PRIMARY KEY (guild_id, user_id, job_name)
+        );
+        CREATE TABLE IF NOT EXISTS settings(
+            guild_id BIGINT PRIMARY KEY,
+            dashboard_channel_id BIGINT,
+            dashboard_message_id BIGINT
+        );
+        """),
+        # Agrégats par membre (nb de métiers, somme, moyenne) tenus à jour par trigger sur `jobs` :
+        # le classement du dashboard devient un parcours d'index (guild_id, avg DESC, user_id).
+        (2, "agrégats member_stats", """
+        LOCK TABLE jobs IN SHARE ROW EXCLUSIVE MODE;
+        CREATE TABLE IF NOT EXISTS member_stats(
+            guild_id  BIGINT NOT NULL,
+            user_id   BIGINT NOT NULL,
+            job_count INT    NOT NULL,
+            level_sum INT    NOT NULL,
+            avg       FLOAT8 GENERATED ALWAYS AS (level_sum::float8 / NULLIF(job_count, 0)) STORED,
+            PRIMARY KEY (guild_id, user_id)
+        );
+        CREATE INDEX IF NOT EXISTS member_stats_rank_idx ON member_stats (guild_id, avg DESC, user_id);
+
+        CREATE OR REPLACE FUNCTION jobs_member_stats() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            IF TG_OP <> 'INSERT' THEN
+                UPDATE member_stats SET job_count = job_count - 1, level_sum = level_sum - OLD.level
+                WHERE guild_id = OLD.guild_id AND user_id = OLD.user_id;
+            END IF;
+            IF TG_OP <> 'DELETE' THEN
+                INSERT INTO member_stats(guild_id, user_id, job_count, level_sum)
+                VALUES (NEW.guild_id, NEW.user_id, 1, NEW.level)
+                ON CONFLICT (guild_id, user_id) DO UPDATE
+                SET job_count = member_stats.job_count + 1, level_sum = member_stats.level_sum + EXCLUDED.level_sum;
+            END IF;
+            IF TG_OP <> 'INSERT' THEN
+                DELETE FROM member_stats
+                WHERE guild_id = OLD.guild_id AND user_id = OLD.user_id AND job_count <= 0;
+            END IF;
+            RETURN NULL;
+        END $$;
+        DROP TRIGGER IF EXISTS jobs_member_stats ON jobs;
+        CREATE TRIGGER jobs_member_stats AFTER INSERT OR UPDATE OR DELETE ON jobs
+        FOR EACH ROW EXECUTE FUNCTION jobs_member_stats();
+
+        -- Recalcul complet (jobs verrouillée en écriture pendant ce temps)
+        DELETE FROM member_stats;
+        INSERT INTO member_stats(guild_id, user_id, job_count, level_sum)
+        SELECT guild_id, user_id, COUNT(*), SUM(level) FROM jobs GROUP BY guild_id, user_id;
+        """),
+        # Vue filtrée par métier ("qui est le meilleur forgeron") : parcours d'index trié par niveau
+        (3, "index jobs (métier, niveau)", concurrent_index("jobs_job_level_idx", "ON jobs (guild_id, job_name, level DESC, user_id)")),
+        (4, "métadonnées du bot", """
+        CREATE TABLE IF NOT EXISTS bot_meta(
+            key   TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+        """),
+        # Une notification "guild_id:application_name" par écriture. Postgres fusionne les notifications
+        # identiques d'une même transaction : un import massif n'en envoie qu'une par guilde.
+        (5, "notifications de changement", f"""
+        CREATE OR REPLACE FUNCTION notify_roster_change() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            PERFORM pg_notify('{NOTIFY_CHANNEL}',
+                COALESCE(NEW.guild_id, OLD.guild_id)::text || ':' || current_setting('application_name'));
+            RETURN NULL;
+        END $$;
+        DROP TRIGGER IF EXISTS jobs_notify ON jobs;
+        CREATE TRIGGER jobs_notify AFTER INSERT OR UPDATE OR DELETE ON jobs
+        FOR EACH ROW EXECUTE FUNCTION notify_roster_change();
+        DROP TRIGGER IF EXISTS profiles_notify ON profiles;
+        CREATE TRIGGER profiles_notify AFTER INSERT OR UPDATE OR DELETE ON profiles
+        FOR EACH ROW EXECUTE FUNCTION notify_roster_change();
+        """),
+        # Pseudo Discord affiché, tenu à jour par DisplayNameWriter : le rendu n'a plus besoin du cache membres
+        (6, "pseudos Discord", """
+        ALTER TABLE profiles ADD COLUMN IF NOT EXISTS display_name TEXT
+        """),
+    ]
+
+    async def listen(self, callback):
+        # Écoute les changements faits ailleurs (autre instance, SQL d'admin) sur une connexion dédiée.
+        # callback(guild_id) est appelé après invalidation du cache de la guilde.
+        if DB_POOLER_MODE == "transaction" and not DB_LISTEN_DSN:
+            log.warning("LISTEN désactivé : pooler en mode transaction sans DB_LISTEN_DSN")
+            return
+        self._listen_callback = callback
+        await self._connect_listener()
+
+    async def _connect_listener(self):
+        delay = 1
+        while True:
+            try:
+                conn = await asyncpg.connect(DB_LISTEN_DSN or self.dsn, server_settings={"application_name": self.application_name})
+                await conn.add_listener(NOTIFY_CHANNEL, self._on_notify)
+                conn.add_termination_listener(self._on_listener_lost)
+                self._listener = conn
+                log.info("LISTEN %s actif", NOTIFY_CHANNEL)
+                return
+            except Exception as e:
+                log.warning("Connexion LISTEN impossible (%s), nouvel essai dans %ss", e, delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60)
+
+    def _on_listener_lost(self, conn):
+        if self._listen_callback is None:
+            return  # fermeture volontaire
+        # Des notifications ont pu être perdues pendant la coupure : tout le cache est suspect
+        log.warning("Connexion LISTEN perdue, reconnexion")
+        self.cache.clear()
+        asyncio.get_running_loop().create_task(self._connect_listener())
+
+    def _on_notify(self, conn, pid, channel, payload: str):
+        guild_id, _, origin = payload.partition(":")
+        if origin == self.application_name or not guild_id.isdigit():
+            return  # notre propre écriture : déjà invalidée et rafraîchissement déjà demandé
+        guild_id = int(guild_id)
+        self.cache.invalidate(guild_id)
+        self._listen_callback(guild_id)
+
+    async def close(self):
+        self._listen_callback = None
+        if self._listener is not None:
+            await self._listener.close()
+        if self.pool is not None:
+            await self.pool.close()
 
     async def set_profile_name(self, guild_id: int, user_id: int, name: str):
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             await conn.execute("""
             INSERT INTO profiles(guild_id,user_id,dofus_name)
             VALUES($1,$2,$3)
             ON CONFLICT (guild_id,user_id) DO UPDATE SET dofus_name=EXCLUDED.dofus_name
             """, guild_id, user_id, name)
+        self.cache.invalidate(guild_id)
 
     async def get_profile_name(self, guild_id: int, user_id: int):
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             row = await conn.fetchrow("""
             SELECT dofus_name FROM profiles WHERE guild_id=$1 AND user_id=$2
             """, guild_id, user_id)
             return row["dofus_name"] if row else None
 
+    # Seuls les membres présents au classement ont besoin d'un pseudo : pas de ligne créée pour les autres
+    _DISPLAY_NAMES_SQL = """
+    INSERT INTO profiles(guild_id,user_id,display_name)
+    SELECT n.guild_id, n.user_id, n.display_name
+    FROM unnest($1::bigint[], $2::bigint[], $3::text[]) AS n(guild_id, user_id, display_name)
+    WHERE EXISTS (SELECT 1 FROM member_stats s WHERE s.guild_id=n.guild_id AND s.user_id=n.user_id)
+       OR EXISTS (SELECT 1 FROM profiles p WHERE p.guild_id=n.guild_id AND p.user_id=n.user_id)
+    ON CONFLICT (guild_id,user_id) DO UPDATE SET display_name=EXCLUDED.display_name
+    WHERE profiles.display_name IS DISTINCT FROM EXCLUDED.display_name
+    RETURNING guild_id
+    """
+
+    async def set_display_names(self, names: list[tuple[int, int, str]]):
+        # Écriture groupée de [(guild_id, user_id, pseudo)] en une requête ; seules les guildes
+        # dont un pseudo a réellement changé sont invalidées.
+        guild_ids, user_ids, display_names = zip(*names)
+        async with self._acquire() as conn:
+            rows = await conn.fetch(self._DISPLAY_NAMES_SQL, list(guild_ids), list(user_ids), list(display_names))
+        for guild_id in {r["guild_id"] for r in rows}:
+            self.cache.invalidate(guild_id)
+
     async def set_job(self, guild_id: int, user_id: int, job: str, level: int):
         job = norm(job)
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             await conn.execute("""
             INSERT INTO jobs(guild_id,user_id,job_name,level)
             VALUES($1,$2,$3,$4)
             ON CONFLICT (guild_id,user_id,job_name) DO UPDATE SET level=EXCLUDED.level
             """, guild_id, user_id, job, level)
+        self.cache.invalidate(guild_id)
 
     async def remove_job(self, guild_id: int, user_id: int, job: str):
         job = norm(job)
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             await conn.execute("""
             DELETE FROM jobs WHERE guild_id=$1 AND user_id=$2 AND job_name=$3
             """, guild_id, user_id, job)
+        self.cache.invalidate(guild_id)
+
+    async def import_jobs(self, guild_id: int, records: list[tuple[int, str, int]]):
+        # Import en masse : COPY vers une table temporaire puis fusion en une transaction.
+        # `records` = [(user_id, métier normalisé, niveau)], sans doublon (user_id, métier).
+        async with self._acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("""
+                CREATE TEMP TABLE jobs_import(user_id BIGINT, job_name TEXT, level INT) ON COMMIT DROP
+                """)
+                await conn.copy_records_to_table("jobs_import", records=records)
+                await conn.execute("""
+                INSERT INTO jobs(guild_id,user_id,job_name,level)
+                SELECT $1, user_id, job_name, level FROM jobs_import
+                ON CONFLICT (guild_id,user_id,job_name) DO UPDATE SET level=EXCLUDED.level
+                """, guild_id)
+        self.cache.invalidate(guild_id)
 
     async def list_user_jobs(self, guild_id: int, user_id: int):
-        async with self.pool.acquire() as conn:
+        async with self._acquire() as conn:
             rows = await conn.fetch("""
             SELECT job_name, level FROM jobs
             WHERE guild_id=$1 AND user_id=$2
@@ -126,36 +1091,105 @@ class DB:
             out = [(r["job_name"], r["level"]) for r in rows]
             return sorted(out, key=lambda r: (-r[1], r[0]))
 
-    async def roster(self, guild_id: int):
-        async with self.pool.acquire() as conn:
+    async def _load_roster(self, guild_id: int):
+        async with self._acquire() as conn:
             rows = await conn.fetch("""
-            SELECT j.user_id, p.dofus_name, j.job_name, j.level
+            SELECT j.user_id, p.display_name, p.dofus_name, j.job_name, j.level
             FROM jobs j
             LEFT JOIN profiles p ON p.guild_id=j.guild_id AND p.user_id=j.user_id
             WHERE j.guild_id=$1
             """, guild_id)
-        data = {}
-        for r in rows:
-            lst = data.setdefault(r["user_id"], {"name": r["dofus_name"], "jobs": []})
-            lst["jobs"].append((r["job_name"], r["level"]))
-        result = []
-        for uid, info in data.items():
-            jobs = sorted(info["jobs"], key=lambda r: (-r[1], r[0]))
-            avg = sum(l for _, l in jobs) / len(jobs)
-            result.append((uid, info["name"], jobs, avg))
-        result.sort(key=lambda x: (-x[3], x[0]))
-        return result
+        return self._aggregate(rows), len(rows)
 
-    async def get_dashboard(self, guild_id: int):
-        async with self.pool.acquire() as conn:
+    async def _load_page(self, guild_id: int, page: int, job_filter: str | None, per_page: int):
+        async with self._acquire() as conn:
+            total = await self._count_members(conn, guild_id, job_filter)
+            page = max(0, min(page, math.ceil(total / per_page) - 1))
+            rows = await self._fetch_page(conn, guild_id, page, job_filter, per_page) if total else []
+        return self._page_chunk(rows, job_filter), total, page, len(rows)
+
+    async def _count_members(self, conn, guild_id: int, job_filter: str | None) -> int:
+        if job_filter is None:
+            return await conn.fetchval("SELECT COUNT(*) FROM member_stats WHERE guild_id=$1", guild_id)
+        # (guild_id, user_id, job_name) est la clé primaire : une ligne = un membre
+        return await conn.fetchval("""
+        SELECT COUNT(*) FROM jobs WHERE guild_id=$1 AND job_name=$2
+        """, guild_id, job_filter)
+
+    async def _fetch_page(self, conn, guild_id: int, page: int, job_filter: str | None, per_page: int):
+        if job_filter is not None:
+            # Parcours de jobs_job_level_idx (guild_id, job_name, level DESC, user_id)
+            return await conn.fetch("""
+            SELECT j.user_id, s.avg, p.display_name, p.dofus_name, j.job_name, j.level
+            FROM jobs j
+            LEFT JOIN member_stats s ON s.guild_id=$1 AND s.user_id=j.user_id
+            LEFT JOIN profiles p ON p.guild_id=$1 AND p.user_id=j.user_id
+            WHERE j.guild_id=$1 AND j.job_name=$4
+            ORDER BY j.level DESC, j.user_id
+            LIMIT $2 OFFSET $3
+            """, guild_id, per_page, page * per_page, job_filter)
+        # Classement lu dans member_stats via l'index (guild_id, avg DESC, user_id), puis détail des métiers de la page
+        return await conn.fetch("""
+        WITH ranked AS (
+            SELECT s.user_id, s.avg
+            FROM member_stats s
+            WHERE s.guild_id=$1
+            ORDER BY s.avg DESC, s.user_id
+            LIMIT $2 OFFSET $3
+        )
+        SELECT r.user_id, r.avg, p.display_name, p.dofus_name, j.job_name, j.level
+        FROM ranked r
+        JOIN jobs j ON j.guild_id=$1 AND j.user_id=r.user_id
+        LEFT JOIN profiles p ON p.guild_id=$1 AND p.user_id=r.user_id
+        ORDER BY r.avg DESC, r.user_id, j.level DESC, j.job_name
+        """, guild_id, per_page, page * per_page)
+
+    async def explain_roster(self, guild_id: int, job_filter: str | None = None) -> list[str]:
+        # Plans EXPLAIN (ANALYZE, BUFFERS) des requêtes de la 1re page du dashboard (comptage + page).
+        # Les requêtes sont réellement exécutées (lecture seule).
+        async with self._acquire() as conn:
+            explain = ExplainConn(conn)
+            await self._count_members(explain, guild_id, job_filter)
+            await self._fetch_page(explain, guild_id, 0, job_filter, CARDS_PER_PAGE)
+        return explain.plans
+
+    def _export_query(self, guild_id: int):
+        return """
+        SELECT j.user_id, p.dofus_name, j.job_name, j.level
+        FROM jobs j
+        LEFT JOIN profiles p ON p.guild_id=j.guild_id AND p.user_id=j.user_id
+        WHERE j.guild_id=$1
+        ORDER BY j.user_id, j.job_name
+        """, (guild_id,)
+
+    async def export_csv(self, guild_id: int, output):
+        # COPY ... TO STDOUT en CSV, écrit au fil de l'eau dans `output` (fichier binaire) :
+        # rien n'est matérialisé en mémoire côté bot, quelle que soit la taille de la guilde.
+        query, args = self._export_query(guild_id)
+        async with self._acquire() as conn:
+            return await conn.copy_from_query(query, *args, output=output, format="csv", header=True)
+
+    async def _load_dashboard(self, guild_id: int):
+        async with self._acquire() as conn:
             row = await conn.fetchrow("""
             SELECT dashboard_channel_id, dashboard_message_id
             FROM settings WHERE guild_id=$1
             """, guild_id)
-            return (row["dashboard_channel_id"], row["dashboard_message_id"]) if row else (None, None)
+        return (row["dashboard_channel_id"], row["dashboard_message_id"]) if row else (None, None)
+
+    async def get_meta(self, key: str):
+        async with self._acquire() as conn:
+            return await conn.fetchval("SELECT value FROM bot_meta WHERE key=$1", key)
 
-    async def set_dashboard(self, guild_id: int, channel_id: int, message_id: int):
-        async with self.pool.acquire() as conn:
+    async def set_meta(self, key: str, value: str):
+        async with self._acquire() as conn:
+            await conn.execute("""
+            INSERT INTO bot_meta(key, value) VALUES($1,$2)
+            ON CONFLICT (key) DO UPDATE SET value=EXCLUDED.value
+            """, key, value)
+
+    async def _save_dashboard(self, guild_id: int, channel_id: int | None, message_id: int | None):
+        async with self._acquire() as conn:
             await conn.execute("""
             INSERT INTO settings(guild_id, dashboard_channel_id, dashboard_message_id)
             VALUES($1,$2,$3)
@@ -164,7 +1198,536 @@ class DB:
               dashboard_message_id=EXCLUDED.dashboard_message_id
             """, guild_id, channel_id, message_id)
 
-db = DB()
+class WideDB(DB):
+    # Stockage compact : une ligne par membre, niveaux dans profiles.levels (SMALLINT[],
+    # ordre du catalogue, 0 = métier absent). Plus de ligne ni d'entrée d'index par métier,
+    # et plus de jointure jobs/profiles pour lire une guilde.
+    # Agrégats (nb de métiers, somme) recalculés depuis le tableau, pour les lignes filtrées par `where`
+    _RECOUNT_SQL = """
+    UPDATE profiles SET
+        job_count = (SELECT COUNT(*) FROM unnest(levels) AS l WHERE l > 0),
+        level_sum = (SELECT COALESCE(SUM(l), 0) FROM unnest(levels) AS l WHERE l > 0)
+    WHERE {where}
+    """
+
+    async def migrate_from_rows(self, conn):
+        # Reprise des données de `jobs` (une ligne par métier) vers profiles.levels (étape de migration,
+        # donc dans une transaction), puis `jobs` est vidée. Copie des lignes d'origine dans jobs_rows_backup
+        # seulement avec WIDE_MIGRATION_BACKUP=1.
+        await conn.execute("LOCK TABLE jobs IN SHARE ROW EXCLUSIVE MODE")
+        if not await conn.fetchval("SELECT EXISTS (SELECT 1 FROM jobs)"):
+            return
+        catalogue = [normed for _, normed in METIER_LABELS]
+        unknown = await conn.fetchval("SELECT COUNT(*) FROM jobs WHERE NOT job_name = ANY($1::text[])", catalogue)
+        if unknown:
+            # Intransposables dans le tableau de niveaux : laissées telles quelles dans `jobs`
+            log.warning("Migration wide : %s ligne(s) avec un métier hors catalogue laissée(s) dans jobs", unknown)
+        await conn.execute("""
+        INSERT INTO profiles(guild_id, user_id, levels)
+        SELECT m.guild_id, m.user_id,
+               ARRAY(SELECT COALESCE(j.level, 0)::smallint
+                     FROM unnest($1::text[]) WITH ORDINALITY AS c(job_name, ord)
+                     LEFT JOIN jobs j ON j.guild_id=m.guild_id AND j.user_id=m.user_id AND j.job_name=c.job_name
+                     ORDER BY c.ord)
+        FROM (SELECT DISTINCT guild_id, user_id FROM jobs) m
+        ON CONFLICT (guild_id, user_id) DO UPDATE SET levels=EXCLUDED.levels
+        """, catalogue)
+        await conn.execute(self._RECOUNT_SQL.format(
+            where="(guild_id, user_id) IN (SELECT guild_id, user_id FROM jobs)"))
+        if WIDE_MIGRATION_BACKUP:
+            await conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs_rows_backup (LIKE jobs INCLUDING ALL);
+            INSERT INTO jobs_rows_backup SELECT * FROM jobs ON CONFLICT DO NOTHING;
+            """)
+            log.info("Lignes de jobs sauvegardées dans jobs_rows_backup : DROP TABLE jobs_rows_backup une fois vérifié")
+        await conn.execute("DELETE FROM jobs WHERE job_name = ANY($1::text[])", catalogue)
+        log.info("Migration vers le stockage wide terminée")
+
+    # Les versions 100+ ne concernent que ce stockage
+    MIGRATIONS = DB.MIGRATIONS + [
+        (101, "wide : tableau de niveaux", f"""
+        ALTER TABLE profiles ADD COLUMN IF NOT EXISTS levels SMALLINT[] NOT NULL DEFAULT '{ZERO_LEVELS}'
+        """),
+        # Équivalent de member_stats : colonnes tenues à jour par set_job/remove_job, moyenne générée
+        (102, "wide : agrégats par membre", """
+        ALTER TABLE profiles
+            ADD COLUMN IF NOT EXISTS job_count INT NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS level_sum INT NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS avg FLOAT8 GENERATED ALWAYS AS (level_sum::float8 / NULLIF(job_count, 0)) STORED;
+        """ + _RECOUNT_SQL.format(where="TRUE")),
+        (103, "wide : index de classement", concurrent_index("profiles_rank_idx", "ON profiles (guild_id, avg DESC, user_id)")),
+        (104, "wide : reprise des données de jobs", migrate_from_rows),
+        # `jobs` reste (vide) mais n'est plus lue : ses agrégats et son index ne font que ralentir les écritures
+        (105, "wide : suppression des agrégats et index de jobs", """
+        DROP TRIGGER IF EXISTS jobs_member_stats ON jobs;
+        DROP FUNCTION IF EXISTS jobs_member_stats();
+        DROP TABLE IF EXISTS member_stats;
+        DROP INDEX IF EXISTS jobs_job_level_idx;
+        """),
+    ]
+
+    # member_stats n'existe pas ici : un membre classé a toujours sa ligne dans profiles
+    _DISPLAY_NAMES_SQL = """
+    UPDATE profiles p SET display_name=n.display_name
+    FROM unnest($1::bigint[], $2::bigint[], $3::text[]) AS n(guild_id, user_id, display_name)
+    WHERE p.guild_id=n.guild_id AND p.user_id=n.user_id
+      AND p.display_name IS DISTINCT FROM n.display_name
+    RETURNING p.guild_id
+    """
+
+    def _export_query(self, guild_id: int):
+        # Même format que l'export "rows" : une ligne par (membre, métier)
+        return """
+        SELECT p.user_id, p.dofus_name, c.job_name, p.levels[c.ord] AS level
+        FROM profiles p
+        CROSS JOIN unnest($2::text[]) WITH ORDINALITY AS c(job_name, ord)
+        WHERE p.guild_id=$1 AND p.levels[c.ord] > 0
+        ORDER BY p.user_id, c.job_name
+        """, (guild_id, [normed for _, normed in METIER_LABELS])
+
+    @staticmethod
+    def _decode(levels, job_filter: str | None = None):
+        # Tableau de niveaux -> [(métier, niveau)] triés comme DB.list_user_jobs
+        jobs = [(normed, lvl) for (_, normed), lvl in zip(METIER_LABELS, levels or ()) if lvl]
+        if job_filter:
+            jobs = [(j, lvl) for j, lvl in jobs if j == job_filter]
+        return sorted(jobs, key=lambda r: (-r[1], r[0]))
+
+    async def set_job(self, guild_id: int, user_id: int, job: str, level: int):
+        job = norm(job)
+        idx = JOB_INDEX.get(job)
+        if idx is None:
+            raise ValueError(f"Métier inconnu pour le stockage wide : {job}")
+        levels = [0] * len(JOB_INDEX)
+        levels[idx - 1] = level
+        async with self._acquire() as conn:
+            await conn.execute("""
+            INSERT INTO profiles(guild_id,user_id,levels,job_count,level_sum)
+            VALUES($1,$2,$3::smallint[],1,$5)
+            ON CONFLICT (guild_id,user_id) DO UPDATE SET
+              levels[$4]=$5,
+              job_count=profiles.job_count + (COALESCE(profiles.levels[$4], 0) = 0)::int,
+              level_sum=profiles.level_sum - COALESCE(profiles.levels[$4], 0) + $5
+            """, guild_id, user_id, levels, idx, level)
+        self.cache.invalidate(guild_id)
+
+    async def remove_job(self, guild_id: int, user_id: int, job: str):
+        idx = JOB_INDEX.get(norm(job))
+        if idx is None:
+            return
+        async with self._acquire() as conn:
+            await conn.execute("""
+            UPDATE profiles SET
+              levels[$3]=0,
+              job_count=job_count - (COALESCE(levels[$3], 0) > 0)::int,
+              level_sum=level_sum - COALESCE(levels[$3], 0)
+            WHERE guild_id=$1 AND user_id=$2
+            """, guild_id, user_id, idx)
+        self.cache.invalidate(guild_id)
+
+    async def import_jobs(self, guild_id: int, records: list[tuple[int, str, int]]):
+        # Même principe que DB.import_jobs ; la fusion remplace les positions importées
+        # et garde les autres niveaux du tableau.
+        staged = [(uid, JOB_INDEX[job], lvl) for uid, job, lvl in records if job in JOB_INDEX]
+        async with self._acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("""
+                CREATE TEMP TABLE jobs_import(user_id BIGINT, idx INT, level INT) ON COMMIT DROP
+                """)
+                await conn.copy_records_to_table("jobs_import", records=staged)
+                await conn.execute("""
+                INSERT INTO profiles(guild_id,user_id)
+                SELECT DISTINCT $1::bigint, user_id FROM jobs_import
+                ON CONFLICT (guild_id,user_id) DO NOTHING
+                """, guild_id)
+                await conn.execute("""
+                UPDATE profiles p SET levels = ARRAY(
+                    SELECT COALESCE(i.level, p.levels[c.ord], 0)::smallint
+                    FROM generate_series(1, GREATEST(cardinality(p.levels), $2)) AS c(ord)
+                    LEFT JOIN jobs_import i ON i.user_id=p.user_id AND i.idx=c.ord
+                    ORDER BY c.ord)
+                WHERE p.guild_id=$1 AND p.user_id IN (SELECT user_id FROM jobs_import)
+                """, guild_id, len(JOB_INDEX))
+                await conn.execute(self._RECOUNT_SQL.format(
+                    where="guild_id=$1 AND user_id IN (SELECT user_id FROM jobs_import)"), guild_id)
+        self.cache.invalidate(guild_id)
+
+    async def list_user_jobs(self, guild_id: int, user_id: int):
+        async with self._acquire() as conn:
+            levels = await conn.fetchval("""
+            SELECT levels FROM profiles WHERE guild_id=$1 AND user_id=$2
+            """, guild_id, user_id)
+        return self._decode(levels)
+
+    async def _load_roster(self, guild_id: int):
+        async with self._acquire() as conn:
+            rows = await conn.fetch("""
+            SELECT user_id, display_name, dofus_name, levels FROM profiles WHERE guild_id=$1
+            """, guild_id)
+        result = []
+        for r in rows:
+            jobs = self._decode(r["levels"])
+            if jobs:
+                result.append((r["user_id"], r["display_name"], r["dofus_name"], jobs, sum(l for _, l in jobs) / len(jobs)))
+        result.sort(key=lambda x: (-x[4], x[0]))
+        return result, len(rows)
+
+    async def _fetch_page(self, conn, guild_id: int, page: int, job_filter: str | None, per_page: int):
+        if job_filter is not None:
+            # Tri par niveau du métier filtré. Pas d'index par position du tableau (il en faudrait un
+            # par métier) : on parcourt les lignes de la guilde, une par membre.
+            # Métier hors catalogue -> index 0 -> levels[0] IS NULL : aucun résultat plutôt qu'aucun filtre
+            return await conn.fetch("""
+            SELECT user_id, display_name, dofus_name, levels, avg
+            FROM profiles
+            WHERE guild_id=$1 AND levels[$4] > 0
+            ORDER BY levels[$4] DESC, user_id
+            LIMIT $2 OFFSET $3
+            """, guild_id, per_page, page * per_page, JOB_INDEX.get(job_filter, 0))
+        return await conn.fetch("""
+        SELECT user_id, display_name, dofus_name, levels, avg
+        FROM profiles
+        WHERE guild_id=$1 AND avg IS NOT NULL
+        ORDER BY avg DESC, user_id
+        LIMIT $2 OFFSET $3
+        """, guild_id, per_page, page * per_page)
+
+    def _page_chunk(self, rows, job_filter: str | None):
+        return [(r["user_id"], r["display_name"], r["dofus_name"], self._decode(r["levels"], job_filter), r["avg"]) for r in rows]
+
+    async def _count_members(self, conn, guild_id: int, job_filter: str | None) -> int:
+        return await conn.fetchval("""
+        SELECT COUNT(*) FROM profiles
+        WHERE guild_id=$1 AND job_count > 0 AND ($2::int IS NULL OR levels[$2] > 0)
+        """, guild_id, JOB_INDEX.get(job_filter, 0) if job_filter else None)
+
+class MemoryStorage(Storage):
+    # Tout en mémoire, rien n'est persisté : essais locaux, benchmarks, tests
+    def __init__(self):
+        super().__init__()
+        self._profiles: dict[tuple[int, int], dict] = {}   # (guild, membre) -> {"dofus_name", "display_name"}
+        self._jobs: dict[tuple[int, int], dict[str, int]] = {}  # (guild, membre) -> {métier: niveau}
+        self._settings: dict[int, tuple[int, int]] = {}
+        self._meta: dict[str, str] = {}
+
+    async def set_profile_name(self, guild_id: int, user_id: int, name: str):
+        self._profiles.setdefault((guild_id, user_id), {"dofus_name": None, "display_name": None})["dofus_name"] = name
+        self.cache.invalidate(guild_id)
+
+    async def get_profile_name(self, guild_id: int, user_id: int):
+        return self._profiles.get((guild_id, user_id), {}).get("dofus_name")
+
+    async def set_display_names(self, names: list[tuple[int, int, str]]):
+        for guild_id, user_id, name in names:
+            key = (guild_id, user_id)
+            if key not in self._profiles and not self._jobs.get(key):
+                continue
+            profile = self._profiles.setdefault(key, {"dofus_name": None, "display_name": None})
+            if profile["display_name"] != name:
+                profile["display_name"] = name
+                self.cache.invalidate(guild_id)
+
+    async def set_job(self, guild_id: int, user_id: int, job: str, level: int):
+        self._jobs.setdefault((guild_id, user_id), {})[norm(job)] = level
+        self.cache.invalidate(guild_id)
+
+    async def remove_job(self, guild_id: int, user_id: int, job: str):
+        self._jobs.get((guild_id, user_id), {}).pop(norm(job), None)
+        self.cache.invalidate(guild_id)
+
+    async def import_jobs(self, guild_id: int, records: list[tuple[int, str, int]]):
+        for user_id, job, level in records:
+            self._jobs.setdefault((guild_id, user_id), {})[job] = level
+        self.cache.invalidate(guild_id)
+
+    async def list_user_jobs(self, guild_id: int, user_id: int):
+        return sorted(self._jobs.get((guild_id, user_id), {}).items(), key=lambda r: (-r[1], r[0]))
+
+    def _members(self, guild_id: int):
+        # -> [(uid, pseudo Discord, pseudo Dofus, {métier: niveau})] des membres ayant au moins un métier
+        out = []
+        for (gid, user_id), jobs in self._jobs.items():
+            if gid == guild_id and jobs:
+                profile = self._profiles.get((gid, user_id), {})
+                out.append((user_id, profile.get("display_name"), profile.get("dofus_name"), jobs))
+        return out
+
+    async def _load_roster(self, guild_id: int):
+        rows = [{"user_id": uid, "display_name": display, "dofus_name": dofus, "job_name": job, "level": lvl}
+                for uid, display, dofus, jobs in self._members(guild_id) for job, lvl in jobs.items()]
+        return self._aggregate(rows), len(rows)
+
+    async def _load_page(self, guild_id: int, page: int, job_filter: str | None, per_page: int):
+        ranked = []
+        for uid, display, dofus, jobs in self._members(guild_id):
+            avg = sum(jobs.values()) / len(jobs)
+            if job_filter is None:
+                ranked.append(((-avg, uid), (uid, display, dofus, sorted(jobs.items(), key=lambda r: (-r[1], r[0])), avg)))
+            elif job_filter in jobs:
+                ranked.append(((-jobs[job_filter], uid), (uid, display, dofus, [(job_filter, jobs[job_filter])], avg)))
+        ranked.sort(key=lambda r: r[0])
+        total = len(ranked)
+        page = max(0, min(page, math.ceil(total / per_page) - 1))
+        chunk = [entry for _, entry in ranked[page * per_page:(page + 1) * per_page]]
+        return chunk, total, page, sum(len(entry[3]) for entry in chunk)
+
+    async def export_csv(self, guild_id: int, output):
+        rows = sorted((uid, dofus, job, lvl) for uid, _, dofus, jobs in self._members(guild_id) for job, lvl in jobs.items())
+        self._write_csv(rows, output)
+
+    async def get_meta(self, key: str):
+        return self._meta.get(key)
+
+    async def set_meta(self, key: str, value: str):
+        self._meta[key] = value
+
+    async def _load_dashboard(self, guild_id: int):
+        return self._settings.get(guild_id, (None, None))
+
+    async def _save_dashboard(self, guild_id: int, channel_id: int | None, message_id: int | None):
+        self._settings[guild_id] = (channel_id, message_id)
+
+class SqliteStorage(Storage):
+    # Un fichier SQLite via aiosqlite, pour les petites guildes auto-hébergées : pas de serveur,
+    # une seule connexion (SQLite sérialise les écritures), agrégats calculés à la lecture.
+    # Même schéma que le stockage Postgres "rows", versionné par PRAGMA user_version.
+    MIGRATIONS = [
+        (1, "tables de base", """
+        CREATE TABLE IF NOT EXISTS profiles(
+            guild_id INTEGER NOT NULL,
+            user_id  INTEGER NOT NULL,
+            dofus_name TEXT,
+            display_name TEXT,
+            PRIMARY KEY (guild_id, user_id)
+        );
+        CREATE TABLE IF NOT EXISTS jobs(
+            guild_id INTEGER NOT NULL,
+            user_id  INTEGER NOT NULL,
+            job_name TEXT NOT NULL,
+            level    INTEGER NOT NULL,
+            PRIMARY KEY (guild_id, user_id, job_name)
+        );
+        CREATE INDEX IF NOT EXISTS jobs_job_level_idx ON jobs (guild_id, job_name, level DESC, user_id);
+        CREATE TABLE IF NOT EXISTS settings(
+            guild_id INTEGER PRIMARY KEY,
+            dashboard_channel_id INTEGER,
+            dashboard_message_id INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS bot_meta(
+            key   TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+        """),
+    ]
+
+    def __init__(self, path: str = SQLITE_PATH):
+        super().__init__()
+        self.path = path
+        self.conn = None
+
+    async def setup(self):
+        if aiosqlite is None:
+            raise RuntimeError("STORAGE_BACKEND=sqlite nécessite le paquet aiosqlite")
+        self.conn = await aiosqlite.connect(self.path)
+        self.conn.row_factory = aiosqlite.Row
+        await self.conn.execute("PRAGMA journal_mode=WAL")
+        await self.migrate()
+
+    async def migrate(self):
+        version = (await (await self.conn.execute("PRAGMA user_version")).fetchone())[0]
+        for step_version, name, script in self.MIGRATIONS:
+            if step_version <= version:
+                continue
+            log.info("Migration SQLite %s : %s", step_version, name)
+            await self.conn.executescript(script)
+            await self.conn.execute(f"PRAGMA user_version = {step_version}")
+            await self.conn.commit()
+
+    async def close(self):
+        if self.conn is not None:
+            await self.conn.close()
+
+    async def _write(self, guild_id: int | None, sql: str, *args):
+        await self.conn.execute(sql, args)
+        await self.conn.commit()
+        if guild_id is not None:
+            self.cache.invalidate(guild_id)
+
+    async def _fetchall(self, sql: str, *args):
+        async with self.conn.execute(sql, args) as cur:
+            return await cur.fetchall()
+
+    async def _fetchval(self, sql: str, *args):
+        async with self.conn.execute(sql, args) as cur:
+            row = await cur.fetchone()
+        return row[0] if row else None
+
+    async def set_profile_name(self, guild_id: int, user_id: int, name: str):
+        await self._write(guild_id, """
+        INSERT INTO profiles(guild_id,user_id,dofus_name) VALUES(?,?,?)
+        ON CONFLICT (guild_id,user_id) DO UPDATE SET dofus_name=excluded.dofus_name
+        """, guild_id, user_id, name)
+
+    async def get_profile_name(self, guild_id: int, user_id: int):
+        return await self._fetchval("SELECT dofus_name FROM profiles WHERE guild_id=? AND user_id=?", guild_id, user_id)
+
+    async def set_display_names(self, names: list[tuple[int, int, str]]):
+        changed = set()
+        for guild_id, user_id, name in names:
+            cur = await self.conn.execute("""
+            UPDATE profiles SET display_name=?3 WHERE guild_id=?1 AND user_id=?2 AND display_name IS NOT ?3
+            """, (guild_id, user_id, name))
+            if not cur.rowcount:
+                # Pas encore de profil : créé seulement si le membre apparaît au classement
+                cur = await self.conn.execute("""
+                INSERT INTO profiles(guild_id,user_id,display_name)
+                SELECT ?1, ?2, ?3 WHERE EXISTS (SELECT 1 FROM jobs WHERE guild_id=?1 AND user_id=?2)
+                ON CONFLICT (guild_id,user_id) DO NOTHING
+                """, (guild_id, user_id, name))
+            if cur.rowcount:
+                changed.add(guild_id)
+        await self.conn.commit()
+        for guild_id in changed:
+            self.cache.invalidate(guild_id)
+
+    async def set_job(self, guild_id: int, user_id: int, job: str, level: int):
+        await self._write(guild_id, """
+        INSERT INTO jobs(guild_id,user_id,job_name,level) VALUES(?,?,?,?)
+        ON CONFLICT (guild_id,user_id,job_name) DO UPDATE SET level=excluded.level
+        """, guild_id, user_id, norm(job), level)
+
+    async def remove_job(self, guild_id: int, user_id: int, job: str):
+        await self._write(guild_id, "DELETE FROM jobs WHERE guild_id=? AND user_id=? AND job_name=?", guild_id, user_id, norm(job))
+
+    async def import_jobs(self, guild_id: int, records: list[tuple[int, str, int]]):
+        await self.conn.executemany("""
+        INSERT INTO jobs(guild_id,user_id,job_name,level) VALUES(?,?,?,?)
+        ON CONFLICT (guild_id,user_id,job_name) DO UPDATE SET level=excluded.level
+        """, [(guild_id, uid, job, lvl) for uid, job, lvl in records])
+        await self.conn.commit()
+        self.cache.invalidate(guild_id)
+
+    async def list_user_jobs(self, guild_id: int, user_id: int):
+        rows = await self._fetchall("""
+        SELECT job_name, level FROM jobs WHERE guild_id=? AND user_id=? ORDER BY level DESC, job_name
+        """, guild_id, user_id)
+        return [(r["job_name"], r["level"]) for r in rows]
+
+    async def _load_roster(self, guild_id: int):
+        rows = await self._fetchall("""
+        SELECT j.user_id, p.display_name, p.dofus_name, j.job_name, j.level
+        FROM jobs j
+        LEFT JOIN profiles p ON p.guild_id=j.guild_id AND p.user_id=j.user_id
+        WHERE j.guild_id=?
+        """, guild_id)
+        return self._aggregate(rows), len(rows)
+
+    async def _load_page(self, guild_id: int, page: int, job_filter: str | None, per_page: int):
+        if job_filter is None:
+            total = await self._fetchval("SELECT COUNT(DISTINCT user_id) FROM jobs WHERE guild_id=?", guild_id)
+        else:
+            total = await self._fetchval("SELECT COUNT(*) FROM jobs WHERE guild_id=? AND job_name=?", guild_id, job_filter)
+        page = max(0, min(page, math.ceil(total / per_page) - 1))
+        if not total:
+            return [], 0, page, 0
+        if job_filter is None:
+            rows = await self._fetchall("""
+            WITH ranked AS (
+                SELECT user_id, AVG(level) AS avg FROM jobs WHERE guild_id=?1
+                GROUP BY user_id ORDER BY avg DESC, user_id LIMIT ?2 OFFSET ?3
+            )
+            SELECT r.user_id, r.avg, p.display_name, p.dofus_name, j.job_name, j.level
+            FROM ranked r
+            JOIN jobs j ON j.guild_id=?1 AND j.user_id=r.user_id
+            LEFT JOIN profiles p ON p.guild_id=?1 AND p.user_id=r.user_id
+            ORDER BY r.avg DESC, r.user_id, j.level DESC, j.job_name
+            """, guild_id, per_page, page * per_page)
+        else:
+            rows = await self._fetchall("""
+            SELECT j.user_id, s.avg, p.display_name, p.dofus_name, j.job_name, j.level
+            FROM jobs j
+            JOIN (SELECT user_id, AVG(level) AS avg FROM jobs WHERE guild_id=?1 GROUP BY user_id) s ON s.user_id=j.user_id
+            LEFT JOIN profiles p ON p.guild_id=?1 AND p.user_id=j.user_id
+            WHERE j.guild_id=?1 AND j.job_name=?4
+            ORDER BY j.level DESC, j.user_id
+            LIMIT ?2 OFFSET ?3
+            """, guild_id, per_page, page * per_page, job_filter)
+        return self._page_chunk(rows, job_filter), total, page, len(rows)
+
+    async def export_csv(self, guild_id: int, output):
+        rows = await self._fetchall("""
+        SELECT j.user_id, p.dofus_name, j.job_name, j.level
+        FROM jobs j
+        LEFT JOIN profiles p ON p.guild_id=j.guild_id AND p.user_id=j.user_id
+        WHERE j.guild_id=?
+        ORDER BY j.user_id, j.job_name
+        """, guild_id)
+        self._write_csv((tuple(r) for r in rows), output)
+
+    async def get_meta(self, key: str):
+        return await self._fetchval("SELECT value FROM bot_meta WHERE key=?", key)
+
+    async def set_meta(self, key: str, value: str):
+        await self._write(None, """
+        INSERT INTO bot_meta(key, value) VALUES(?,?) ON CONFLICT (key) DO UPDATE SET value=excluded.value
+        """, key, value)
+
+    async def _load_dashboard(self, guild_id: int):
+        async with self.conn.execute("""
+        SELECT dashboard_channel_id, dashboard_message_id FROM settings WHERE guild_id=?
+        """, (guild_id,)) as cur:
+            row = await cur.fetchone()
+        return (row[0], row[1]) if row else (None, None)
+
+    async def _save_dashboard(self, guild_id: int, channel_id: int | None, message_id: int | None):
+        await self._write(None, """
+        INSERT INTO settings(guild_id, dashboard_channel_id, dashboard_message_id) VALUES(?,?,?)
+        ON CONFLICT (guild_id) DO UPDATE SET
+          dashboard_channel_id=excluded.dashboard_channel_id,
+          dashboard_message_id=excluded.dashboard_message_id
+        """, guild_id, channel_id, message_id)
+
+def make_storage(backend: str = STORAGE_BACKEND) -> Storage:
+    if backend == "postgres":
+        storage = WideDB() if STORAGE_LAYOUT == "wide" else DB()
+    elif backend == "sqlite":
+        storage = SqliteStorage()
+    elif backend == "memory":
+        storage = MemoryStorage()
+    else:
+        raise RuntimeError(f"STORAGE_BACKEND inconnu : {backend}")
+    return instrument_storage(storage)
+
+class LRUCache:
+    # LRU borné avec durée de vie. Sert aux pages de dashboard déjà rendues
+    # ((guild, filtre, page, version du roster) -> (embed, total_pages) : la version change à chaque
+    # écriture, une entrée périmée n'est donc plus jamais demandée) et aux pseudos résolus en mode allégé.
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[tuple, tuple[float, object]] = OrderedDict()
+
+    def get(self, key: tuple):
+        item = self._entries.get(key)
+        if item is None or time.monotonic() - item[0] > self.ttl:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def put(self, key: tuple, value):
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+db = make_storage()
 
 class DashboardView(discord.ui.View):
     def __init__(self, bot: commands.Bot, guild_id: int, total_pages: int, current_page: int = 0, selected_filter: str | None = None):
@@ -177,22 +1740,39 @@ class DashboardView(discord.ui.View):
 
 
     async def update(self, interaction: discord.Interaction, page=None, selected_filter=None):
-        await interaction.response.defer()
+        component = interaction.data.get("custom_id", "?")
+        with span("dashboard.click", guild_id=interaction.guild_id, component=component, page=page, filter=selected_filter):
+            if not METRICS_PORT:
+                return await self._update(interaction, page, selected_filter)
+            started, status = time.perf_counter(), "error"
+            try:
+                await self._update(interaction, page, selected_filter)
+                status = "ok"
+            finally:
+                COMPONENT_LATENCY.observe(time.perf_counter() - started, component, status)
+
+    async def _update(self, interaction: discord.Interaction, page=None, selected_filter=None):
         if page is not None:
             self.current_page = page
         if selected_filter is not None:
             self.selected_filter = selected_filter
         guild = interaction.guild or interaction.message.guild
         if not guild:
-            await interaction.followup.send("Erreur : impossible de trouver la guilde.", ephemeral=True)
+            await interaction.response.send_message("Erreur : impossible de trouver la guilde.", ephemeral=True)
             return
-        await update_dashboard_message(
-            self.bot,
-            guild,
-            interaction.message,
-            self.current_page,
-            self.selected_filter
-        )
+        # On rend d'abord, puis on répond au clic avec le nouveau contenu : un seul appel REST,
+        # qui ne compte pas dans la limite d'edits du salon. Rendu trop lent -> defer puis edit.
+        render = asyncio.create_task(render_dashboard(self.bot, guild, self.current_page, self.selected_filter))
+        done, _ = await asyncio.wait({render}, timeout=INTERACTION_RENDER_BUDGET)
+        if render in done:
+            embed, view = render.result()
+            with span("discord.interaction_edit", deferred=False):
+                await interaction.response.edit_message(embed=embed, view=view)
+        else:
+            await interaction.response.defer()
+            embed, view = await render
+            with span("discord.interaction_edit", deferred=True):
+                await interaction.edit_original_response(embed=embed, view=view)
 
     @discord.ui.button(emoji="◀️", style=discord.ButtonStyle.secondary, custom_id="metiers:prev")
     async def prev_btn_callback(self, interaction: discord.Interaction, button: discord.ui.Button):
@@ -240,33 +1820,35 @@ class DashboardView(discord.ui.View):
             pass
 
 async def build_dashboard_embed(guild: discord.Guild, page: int = 0, job_filter: str | None = None):
-    roster = await db.roster(guild.id)
+    job_filter_norm = norm(job_filter) if job_filter else None
+    # Version lue avant la requête : une écriture concurrente rend simplement la clé obsolète
+    key = (guild.id, job_filter_norm, page, db.cache.version(guild.id))
+    render_cache = bot.shard_state(guild.id).render_cache
+    with span("dashboard.build_embed", guild_id=guild.id, page=page, filter=job_filter_norm) as sp:
+        cached = render_cache.get(key)
+        sp.set("cached", cached is not None)
+        if cached is not None:
+            return cached
+        result = await _build_dashboard_embed(guild, page, job_filter_norm)
+    render_cache.put(key, result)
+    return result
 
+async def _build_dashboard_embed(guild: discord.Guild, page: int, job_filter_norm: str | None):
+    # Pagination, filtre et tri faits côté SQL : on ne récupère que la page affichée
+    chunk, total, page = await db.roster_page(guild.id, page, job_filter_norm)
 
-    job_filter_norm = norm(job_filter) if job_filter else None
     filter_label = None
     if job_filter_norm:
-        # Trouver le label exact (avec emoji) pour le titre
-        for m in EMOJI_BY_METIER.keys():
-            if norm(m) == job_filter_norm:
-                filter_label = display_metier(m)
-                break
-        if not filter_label:
-            filter_label = job_filter.capitalize()
-        # Ne garder que les utilisateurs ayant ce métier
-        roster = [
-            (uid, name, [(j, lvl) for j, lvl in jobs if norm(j) == job_filter_norm], avg)
-            for uid, name, jobs, avg in roster
-            if any(norm(j) == job_filter_norm for j, _ in jobs)
-        ]
-    total_pages = max(1, math.ceil(len(roster) / CARDS_PER_PAGE))
-    page = max(0, min(page, total_pages - 1))
-    start = page * CARDS_PER_PAGE
-    chunk = roster[start:start + CARDS_PER_PAGE]
+        # Label exact (avec emoji) pour le titre : les clés d'EMOJI_BY_METIER sont déjà normalisées
+        if job_filter_norm in EMOJI_BY_METIER:
+            filter_label = display_metier(job_filter_norm)
+        else:
+            filter_label = job_filter_norm.capitalize()
+    total_pages = max(1, math.ceil(total / CARDS_PER_PAGE))
 
     embed = discord.Embed(
         title=DASHBOARD_TITLE if not job_filter_norm else f"{DASHBOARD_TITLE} • Filtre: {filter_label}",
-        description=f"**{len(roster)}** profils • Page **{page+1}/{total_pages}**",
+        description=f"**{total}** profils • Page **{page+1}/{total_pages}**",
         color=discord.Color.purple()
     )
 
@@ -274,26 +1856,65 @@ async def build_dashboard_embed(guild: discord.Guild, page: int = 0, job_filter:
         embed.description += "\n\n*Aucun profil pour l’instant.*"
         return embed, total_pages
 
-    for user_id, dofus_name, jobs, avg in chunk:
-        member = guild.get_member(user_id) if guild else None
-        name_line = member.display_name if member else f"Utilisateur {user_id}"
+    # Pseudos lus avec la page ; seuls ceux jamais enregistrés sont résolus via Discord, puis enregistrés
+    missing = [row[0] for row in chunk if not row[1]]
+    resolved = await resolve_display_names(guild, missing) if missing else {}
+    for user_id, name in resolved.items():
+        bot.display_names.record(guild.id, user_id, name, force=True)
+    for user_id, display_name, dofus_name, jobs, avg in chunk:
+        name_line = display_name or resolved.get(user_id) or f"Utilisateur {user_id}"
         if dofus_name:
             name_line += f" *(aka {dofus_name})*"
-        # Si filtré, n'afficher que les métiers correspondants
-        if job_filter_norm:
-            lines = [f"{display_metier(j)} : **{lvl}**" for j, lvl in jobs if norm(j) == job_filter_norm]
-        else:
-            lines = [f"{display_metier(j)} : **{lvl}**" for j, lvl in jobs]
+        # Si filtré, la requête ne renvoie déjà que le métier correspondant
+        lines = [f"{display_metier(j)} : **{lvl}**" for j, lvl in jobs]
         if lines:
             embed.add_field(name=f"👤 {name_line}", value="\n".join(lines), inline=False)
 
     return embed, total_pages
 
+async def resolve_display_names(guild: discord.Guild, user_ids: list[int]) -> dict[int, str]:
+    # Cache membres de discord.py d'abord ; en mode allégé il est vide : LRU du shard, puis une seule
+    # requête passerelle (opcode 8, 100 ids max) pour les ids manquants de la page.
+    names: dict[int, str] = {}
+    cache = bot.shard_state(guild.id).member_names
+    missing = []
+    with span("discord.get_members", guild_id=guild.id, count=len(user_ids)):
+        for user_id in user_ids:
+            member = guild.get_member(user_id)
+            if member:
+                names[user_id] = member.display_name
+                continue
+            name = cache.get((guild.id, user_id))
+            if name is None:
+                missing.append(user_id)
+            elif name:
+                names[user_id] = name
+    if not missing or not LEAN_GATEWAY:
+        return names
+    try:
+        with span("discord.query_members", guild_id=guild.id, count=len(missing[:100])):
+            members = await guild.query_members(user_ids=missing[:100], limit=100, cache=False)
+    except (asyncio.TimeoutError, discord.ClientException) as e:
+        log.warning("Résolution des pseudos impossible (guild=%s, %d ids) : %r", guild.id, len(missing), e)
+        return names
+    for member in members:
+        names[member.id] = member.display_name
+    for user_id in missing[:100]:
+        # "" = parti du serveur : mis en cache aussi, pour ne pas le redemander à chaque rendu
+        cache.put((guild.id, user_id), names.get(user_id, ""))
+    return names
+
+async def render_dashboard(bot: commands.Bot, guild: discord.Guild, page: int = 0, job_filter: str | None = None):
+    embed, total_pages = await build_dashboard_embed(guild, page, job_filter)
+    view = DashboardView(bot, guild.id, total_pages, page, job_filter)
+    # Plus besoin de synchroniser manuellement le select : Discord.py gère l'état sélectionné automatiquement
+    return embed, view
+
 # --- Version robuste : accepte une Guild ou un ID, résout correctement, log + fallback ---
 async def update_dashboard_message(
     bot: commands.Bot,
     guild_or_id: int | discord.Guild,
-    message: discord.Message,
+    message: discord.Message | discord.PartialMessage,
     page: int = 0,
     job_filter: str | None = None
 ):
@@ -304,17 +1925,18 @@ async def update_dashboard_message(
         if guild is None:
             raise RuntimeError("Guild introuvable (ni via message.guild, ni via bot.get_guild).")
 
-        embed, total_pages = await build_dashboard_embed(guild, page, job_filter)
-        view = DashboardView(bot, guild.id, total_pages, page, job_filter)
-
-        # Plus besoin de synchroniser manuellement le select : Discord.py gère l'état sélectionné automatiquement
-
-        await message.edit(embed=embed, view=view)
+        with span("dashboard.update", guild_id=guild.id, page=page, filter=job_filter) as sp:
+            embed, view = await render_dashboard(bot, guild, page, job_filter)
+            # File par message : si un rendu plus récent arrive avant l'envoi, celui-ci est abandonné
+            sp.set("sent", await bot.shard_state(guild.id).edit_queue.edit(message, embed=embed, view=view))
 
+    except discord.NotFound:
+        raise  # message supprimé : l'appelant oublie le handle
     except Exception as e:
-        log.exception("Erreur update_dashboard_message: %s", e)
+        gid = guild_or_id.id if isinstance(guild_or_id, discord.Guild) else guild_or_id
+        log.exception("Erreur update_dashboard_message (guilde %s, shard %s): %s", gid, bot.shard_id_for(gid), e)
         try:
-            await message.edit(view=None)
+            await bot.shard_state(gid).edit_queue.edit(message, view=None)
             await message.channel.send(
                 f"⚠️ Erreur lors de la mise à jour du dashboard : `{type(e).__name__}: {e}`",
                 delete_after=10
@@ -322,13 +1944,340 @@ async def update_dashboard_message(
         except Exception:
             log.exception("Erreur secondaire en signalant l'erreur.")
 
-class MetiersBot(commands.Bot):
+async def dashboard_message(bot: commands.Bot, guild_id: int) -> discord.PartialMessage | None:
+    # Handle vers le message du dashboard construit depuis les ids stockés :
+    # aucun fetch_channel/fetch_message, l'edit part directement.
+    ch_id, msg_id = await db.get_dashboard(guild_id)
+    if not (ch_id and msg_id):
+        return None
+    return bot.get_partial_messageable(ch_id, guild_id=guild_id).get_partial_message(msg_id)
+
+async def refresh_dashboard(bot: commands.Bot, guild: discord.Guild) -> bool:
+    # Re-rend le dashboard publié de la guilde (page 0, sans filtre). False s'il n'est pas configuré.
+    msg = await dashboard_message(bot, guild.id)
+    if msg is None:
+        return False
+    try:
+        await update_dashboard_message(bot, guild, msg)  # ← passe la Guild
+    except discord.NotFound:
+        log.info("Dashboard introuvable pour la guilde %s (message supprimé ?), handle oublié.", guild.id)
+        await db.forget_dashboard(guild.id)
+        return False
+    return True
+
+class DashboardRefresher:
+    # Regroupe les demandes de rafraîchissement par guilde : un seul rendu après
+    # `debounce` s sans nouvelle demande, et au plus tard `max_delay` s après la première.
+    # Une seule tâche par guilde : les rafraîchissements d'une même guilde ne se chevauchent pas.
+    def __init__(self, bot: commands.Bot, debounce: float = DASHBOARD_REFRESH_DEBOUNCE, max_delay: float = DASHBOARD_REFRESH_MAX_DELAY):
+        self.bot = bot
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self._pending: dict[int, list[float]] = {}  # guild_id -> [première demande, dernière demande]
+        self._tasks: dict[int, asyncio.Task] = {}
+
+    def request(self, guild_id: int):
+        now = asyncio.get_running_loop().time()
+        state = self._pending.get(guild_id)
+        if state is None:
+            self._pending[guild_id] = [now, now]
+        else:
+            state[1] = now
+        if guild_id not in self._tasks:
+            self._tasks[guild_id] = detached_task(self._run(guild_id))
+
+    async def _run(self, guild_id: int):
+        loop = asyncio.get_running_loop()
+        try:
+            while guild_id in self._pending:
+                first, last = self._pending[guild_id]
+                delay = min(last + self.debounce, first + self.max_delay) - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue
+                del self._pending[guild_id]
+                guild = self.bot.get_guild(guild_id)
+                if guild is None:
+                    continue
+                try:
+                    await refresh_dashboard(self.bot, guild)
+                except Exception as e:
+                    log.info("Refresh dashboard différé (guild %s) a échoué: %s", guild_id, e)
+        finally:
+            self._tasks.pop(guild_id, None)
+
+class DisplayNameWriter:
+    # Pseudos Discord à recopier dans profiles.display_name. Les changements s'accumulent et partent
+    # en une requête toutes les `interval` s, ou dès `batch` en attente (arrivées massives).
+    def __init__(self, interval: float = DISPLAY_NAME_FLUSH_INTERVAL, batch: int = DISPLAY_NAME_BATCH):
+        self.interval = interval
+        self.batch = batch
+        self._pending: dict[tuple[int, int], str] = {}
+        self._known = LRUCache(MEMBER_NAME_CACHE_MAX, MEMBER_NAME_CACHE_TTL)  # derniers pseudos écrits
+        self._full = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    def record(self, guild_id: int, user_id: int, name: str, force: bool = False):
+        # force : pseudo absent de la base (membre arrivé au classement depuis la dernière écriture)
+        key = (guild_id, user_id)
+        if not force and self._known.get(key) == name:
+            return
+        self._pending[key] = name
+        if len(self._pending) >= self.batch:
+            self._full.set()
+        if self._task is None or self._task.done():
+            self._task = detached_task(self._run())
+
+    async def _run(self):
+        while self._pending:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            await self.flush()
+
+    async def flush(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        try:
+            await db.set_display_names([(gid, uid, name) for (gid, uid), name in batch.items()])
+        except Exception as e:
+            # Perdus : ils seront réécrits au prochain changement ou au prochain rendu sans pseudo
+            log.warning("Écriture de %d pseudos échouée : %s", len(batch), e)
+            return
+        for key, name in batch.items():
+            self._known.put(key, name)
+
+class TokenBucket:
+    # `rate` jetons rechargés en continu sur `per` secondes
+    def __init__(self, rate: int, per: float):
+        self.capacity = rate
+        self.per = per
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.capacity / self.per)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) * self.per / self.capacity)
+
+class EditQueue:
+    # Edits de messages espacés par un seau à jetons par salon, au lieu de laisser discord.py
+    # dormir sur des 429. Un seul edit en attente par message : un nouveau contenu remplace
+    # l'ancien (qui est abandonné), donc l'état final part dès que la limite le permet.
+    def __init__(self, rate: int = EDIT_RATE, per: float = EDIT_PER):
+        self.rate = rate
+        self.per = per
+        self.superseded = 0
+        self._pending: dict[int, tuple] = {}  # message_id -> (message, kwargs, future)
+        self._tasks: dict[int, asyncio.Task] = {}
+        self._buckets: dict[int, TokenBucket] = {}  # channel_id -> seau
+        self._swept = time.monotonic()
+
+    async def edit(self, message: discord.Message | discord.PartialMessage, **kwargs) -> bool:
+        # True si cet edit a été envoyé, False s'il a été remplacé par un plus récent avant l'envoi
+        fut = asyncio.get_running_loop().create_future()
+        old = self._pending.get(message.id)
+        if old and not old[2].done():
+            old[2].set_result(False)
+            self.superseded += 1
+        self._pending[message.id] = (message, kwargs, fut)
+        if message.id not in self._tasks:
+            self._tasks[message.id] = detached_task(self._worker(message.id, message.channel.id))
+        return await fut
+
+    def _bucket(self, channel_id: int) -> TokenBucket:
+        # Au plus un balayage par période : un seau inutilisé depuis `per` s est plein, identique
+        # à un seau neuf, et peut être oublié sans changer le débit
+        now = time.monotonic()
+        if now - self._swept >= self.per:
+            self._swept = now
+            self._buckets = {cid: b for cid, b in self._buckets.items() if now - b.updated < self.per}
+        bucket = self._buckets.get(channel_id)
+        if bucket is None:
+            bucket = self._buckets[channel_id] = TokenBucket(self.rate, self.per)
+        return bucket
+
+    async def _worker(self, message_id: int, channel_id: int):
+        try:
+            while message_id in self._pending:
+                await self._bucket(channel_id).acquire()
+                # Contenu pris au dernier moment : le plus récent à l'instant où le jeton est disponible
+                message, kwargs, fut = self._pending.pop(message_id)
+                try:
+                    with span("discord.message_edit", channel_id=channel_id, message_id=message_id):
+                        await message.edit(**kwargs)
+                except Exception as e:
+                    if not fut.done():
+                        fut.set_exception(e)
+                else:
+                    if not fut.done():
+                        fut.set_result(True)
+        finally:
+            self._tasks.pop(message_id, None)
+
+class ShardState:
+    # État propre à un shard. Une guilde n'appartient qu'à un shard : ses pages rendues et son
+    # planificateur de rafraîchissement aussi, et un shard peut être réinitialisé sans toucher aux autres.
+    def __init__(self, bot: commands.Bot, shard_id: int):
+        self.shard_id = shard_id
+        self.refresher = DashboardRefresher(bot)
+        self.render_cache = LRUCache(RENDER_CACHE_MAX, RENDER_CACHE_TTL)
+        self.member_names = LRUCache(MEMBER_NAME_CACHE_MAX, MEMBER_NAME_CACHE_TTL)
+        self.edit_queue = EditQueue()
+
+_REST_TOKEN_RE = re.compile(r"/[\w.-]{40,}")  # jetons d'interaction/webhook : jamais dans les labels
+_REST_ID_RE = re.compile(r"/\d+(?=/|$)")
+
+def rest_trace_config() -> aiohttp.TraceConfig:
+    # Compte les appels REST de discord.py par route (ids et jetons masqués) et statut,
+    # et cumule l'attente demandée par les 429 (Retry-After).
+    trace = aiohttp.TraceConfig()
+
+    async def on_request_end(session, ctx, params):
+        path = "/" + params.url.path.split("/api/v", 1)[-1].partition("/")[2]  # sans /api/v10
+        route = _REST_ID_RE.sub("/:id", _REST_TOKEN_RE.sub("/:token", path))
+        status = params.response.status
+        REST_REQUESTS.inc(params.method, route, str(status))
+        if status == 429:
+            try:
+                REST_RATE_LIMIT_WAIT.inc(route, value=float(params.response.headers.get("Retry-After", 0)))
+            except ValueError:
+                pass
+
+    trace.on_request_end.append(on_request_end)
+    return trace
+
+class MetiersTree(app_commands.CommandTree):
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        # Point de départ de la mesure de durée des slash commands (voir observe_command).
+        # Même tâche que le handler : le span de la commande devient le parent de ses appels.
+        interaction.extras["started"] = time.perf_counter()
+        if tracer is not None:
+            command = interaction.command.qualified_name if interaction.command else None
+            sp = interaction.extras["span"] = span(f"command.{command}", guild_id=interaction.guild_id, command=command)
+            sp.activate()
+        return True
+
+def observe_command(interaction: discord.Interaction, status: str, error: BaseException | None = None):
+    started = interaction.extras.get("started")
+    if started is not None and interaction.command is not None:
+        COMMAND_LATENCY.observe(time.perf_counter() - started, interaction.command.qualified_name, status)
+    sp = interaction.extras.pop("span", None)
+    if sp is not None:
+        sp.end(error)
+
+async def monitor_loop_lag(interval: float = LOOP_LAG_INTERVAL):
+    # Un sleep qui se réveille en retard = boucle occupée (rendu, JSON, code bloquant…)
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        LOOP_LAG.observe(max(0.0, loop.time() - started - interval))
+
+def _pool_usage():
+    pool = getattr(db, "pool", None)
+    if pool is None:
+        return {}
+    return {("in_use",): pool.get_size() - pool.get_idle_size(), ("idle",): pool.get_idle_size(), ("max",): pool.get_max_size()}
+
+def _cache_counts(attr: str):
+    caches = [("roster", db.cache)]
+    for state in bot._shard_states.values():
+        caches += [("render", state.render_cache), ("member_names", state.member_names)]
+    out = {}
+    for name, cache in caches:
+        out[(name,)] = out.get((name,), 0) + getattr(cache, attr)
+    return out
+
+METRICS += [
+    Collected("metiers_db_pool_connections", "Connexions du pool Postgres", ("state",), _pool_usage),
+    Collected("metiers_cache_hits_total", "Lectures servies par un cache", ("cache",), lambda: _cache_counts("hits"), "counter"),
+    Collected("metiers_cache_misses_total", "Lectures hors cache", ("cache",), lambda: _cache_counts("misses"), "counter"),
+    Collected("metiers_dashboard_edits_superseded_total", "Edits de dashboard remplacés avant envoi", (),
+              lambda: {(): sum(state.edit_queue.superseded for state in bot._shard_states.values())}, "counter"),
+    Collected("metiers_gateway_latency_seconds", "Latence de la passerelle par shard", ("shard",),
+              lambda: {(str(sid),): lat for sid, lat in getattr(bot, "latencies", [(0, bot.latency)]) if math.isfinite(lat)}),
+]
+
+async def _serve(routes, host: str, port: int) -> web.AppRunner:
+    app = web.Application()
+    app.add_routes(routes)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+async def start_http_servers(bot: commands.Bot) -> list[web.AppRunner]:
+    # /metrics (+ /health) sur METRICS_HOST:METRICS_PORT, /health seul sur HEALTH_HOST:HEALTH_PORT
+    async def metrics(request):
+        return web.Response(body=render_metrics().encode(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    async def health(request):
+        # Prêt = connecté à la passerelle ; 503 pendant le démarrage ou une reconnexion longue
+        ready = bot.is_ready() and not bot.is_closed() and math.isfinite(bot.latency)
+        body = {"status": "ok" if ready else "unavailable", "guilds": len(bot.guilds)}
+        return web.json_response(body, status=200 if ready else 503)
+
+    runners = []
+    if METRICS_PORT:
+        runners.append(await _serve([web.get("/metrics", metrics), web.get("/health", health)], METRICS_HOST, METRICS_PORT))
+        log.info("Métriques exposées sur http://%s:%s/metrics", METRICS_HOST, METRICS_PORT)
+    if HEALTH_PORT and HEALTH_PORT != METRICS_PORT:
+        runners.append(await _serve([web.get("/health", health)], HEALTH_HOST, HEALTH_PORT))
+        log.info("Santé exposée sur http://%s:%s/health", HEALTH_HOST, HEALTH_PORT)
+    return runners
+
+class MetiersBot(commands.AutoShardedBot if SHARDED else commands.Bot):
     def __init__(self):
-        super().__init__(command_prefix="!", intents=INTENTS)
+        kwargs = {"shard_count": SHARD_COUNT, "shard_ids": SHARD_IDS} if SHARDED else {}
+        if LEAN_GATEWAY:
+            # Aucun membre ni message gardé en mémoire : seuls les pseudos affichés sont résolus (resolve_display_names)
+            kwargs.update(member_cache_flags=discord.MemberCacheFlags.none(), chunk_guilds_at_startup=False, max_messages=None)
+        if METRICS_PORT:
+            kwargs["http_trace"] = rest_trace_config()
+        super().__init__(command_prefix="!", intents=INTENTS, tree_cls=MetiersTree, **kwargs)
         self.synced = False
+        self._http_runners: list[web.AppRunner] = []
+        self._loop_lag_task: asyncio.Task | None = None
+        self._shard_states: dict[int, ShardState] = {}
+        self.display_names = DisplayNameWriter()
+
+    def shard_id_for(self, guild_id: int) -> int:
+        # Formule de routage Discord : (guild_id >> 22) % nb_shards
+        return (guild_id >> 22) % (self.shard_count or 1)
+
+    def shard_state(self, guild_id: int) -> ShardState:
+        return self.state_for_shard(self.shard_id_for(guild_id))
+
+    def state_for_shard(self, shard_id: int) -> ShardState:
+        state = self._shard_states.get(shard_id)
+        if state is None:
+            state = self._shard_states[shard_id] = ShardState(self, shard_id)
+        return state
+
+    def refresher_for(self, guild_id: int) -> DashboardRefresher:
+        return self.shard_state(guild_id).refresher
+
+    async def on_shard_ready(self, shard_id: int):
+        # Session neuve (pas un resume) : les pseudos en cache dans les pages rendues peuvent avoir changé
+        self.state_for_shard(shard_id).render_cache.clear()
+        log.info("Shard %s prêt", shard_id)
 
     async def setup_hook(self):
         await db.setup()
+        self._http_runners = await start_http_servers(self)
+        if METRICS_PORT:
+            self._loop_lag_task = asyncio.create_task(monitor_loop_lag())
+        if NOTIFY_ENABLED:
+            await db.listen(self.on_roster_change)
         # View persistante pour que les composants continuent de répondre après un redémarrage (Railway)
         try:
             self.add_view(DashboardView(self, guild_id=0, total_pages=1, current_page=0, selected_filter=None))
@@ -336,9 +2285,71 @@ class MetiersBot(commands.Bot):
         except Exception as e:
             log.exception("add_view persistante a échoué: %s", e)
 
+    def on_roster_change(self, guild_id: int):
+        # Écriture faite hors de ce processus : on rafraîchit le dashboard si la guilde est servie ici
+        if self.get_guild(guild_id) is not None:
+            self.refresher_for(guild_id).request(guild_id)
+
+    async def on_member_join(self, member: discord.Member):
+        self.display_names.record(member.guild.id, member.id, member.display_name)
+
+    async def on_member_update(self, before: discord.Member, after: discord.Member):
+        if before.display_name != after.display_name:
+            self.display_names.record(after.guild.id, after.id, after.display_name)
+
+    async def on_user_update(self, before: discord.User, after: discord.User):
+        # Nom global changé : visible sur chaque serveur où le membre n'a pas de surnom
+        if before.display_name == after.display_name:
+            return
+        for guild in after.mutual_guilds:
+            member = guild.get_member(after.id)
+            if member and not member.nick:
+                self.display_names.record(guild.id, member.id, member.display_name)
+
+    async def on_interaction(self, interaction: discord.Interaction):
+        # Seule source de pseudos frais en mode LEAN_GATEWAY (pas d'événements membres) ; dédoublonné par le writer
+        if interaction.guild_id and isinstance(interaction.user, discord.Member):
+            self.display_names.record(interaction.guild_id, interaction.user.id, interaction.user.display_name)
+
+    async def on_app_command_completion(self, interaction: discord.Interaction, command):
+        observe_command(interaction, "ok")
+
+    async def close(self):
+        await super().close()
+        await self.display_names.flush()
+        if self._loop_lag_task is not None:
+            self._loop_lag_task.cancel()
+        for runner in self._http_runners:
+            await runner.cleanup()
+        await db.close()
+        if tracer is not None:
+            tracer.close()
+
+    def command_tree_hash(self, guild: discord.abc.Snowflake | None = None) -> str:
+        # Empreinte de l'arbre tel qu'envoyé à Discord : noms, descriptions, choix, bornes des paramètres…
+        payload = sorted((cmd.to_dict(self.tree) for cmd in self.tree.get_commands(guild=guild)), key=lambda c: c["name"])
+        return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode()).hexdigest()
+
+    async def sync_commands(self):
+        # tree.sync est un appel REST lent et limité : on ne le fait que si l'arbre a changé
+        guild = discord.Object(id=DEV_GUILD_ID) if DEV_GUILD_ID else None
+        if guild:
+            self.tree.copy_global_to(guild=guild)
+        key = f"tree_hash:{self.application_id}:{DEV_GUILD_ID or 'global'}"
+        digest = self.command_tree_hash(guild)
+        if not COMMANDS_FORCE_SYNC and await db.get_meta(key) == digest:
+            log.info("Slash commands inchangées, synchro ignorée")
+            return
+        await self.tree.sync(guild=guild)
+        await db.set_meta(key, digest)
+        log.info("Slash commands synchronisées (%s)", f"guilde {DEV_GUILD_ID}" if guild else "globales")
+
     async def on_ready(self):
+        if not SHARDED:
+            # Bot simple : pas d'on_shard_ready, on_ready marque chaque nouvelle session de l'unique shard 0
+            await self.on_shard_ready(0)
         if not self.synced:
-            await self.tree.sync()
+            await self.sync_commands()
             self.synced = True
         print(f"Connecté en tant que {self.user} (ID: {self.user.id})")
 
@@ -347,6 +2358,7 @@ bot = MetiersBot()
 # Handler global des erreurs de slash commands (utile pour diagnostiquer en prod Railway)
 @bot.tree.error
 async def on_app_command_error(interaction: discord.Interaction, error: Exception):
+    observe_command(interaction, "error", error)
     log.exception("Erreur app command: %s", error)
     try:
         if interaction.response.is_done():
@@ -372,36 +2384,28 @@ async def dashboard(interaction: discord.Interaction, action: str | None = "setc
     embed, total_pages = await build_dashboard_embed(guild, page=0, job_filter=None)
     view = DashboardView(bot, guild.id, total_pages, 0, None)
 
-    ch_id, msg_id = await db.get_dashboard(guild.id)
-    posted = None
-    if ch_id and msg_id:
+    posted_id = None
+    old = await dashboard_message(bot, guild.id)
+    if old is not None:
         try:
-            ch = guild.get_channel(ch_id) or await guild.fetch_channel(ch_id)
-            msg = await ch.fetch_message(msg_id)
-            await msg.edit(embed=embed, view=view)
-            posted = msg
+            # Même file que les rafraîchissements : un edit concurrent du même message est remplacé, pas doublé
+            await bot.shard_state(guild.id).edit_queue.edit(old, embed=embed, view=view)
+            posted_id = old.id
         except Exception as e:
             log.info("Impossible de réutiliser l'ancien message: %s", e)
-            posted = None
 
-    if not posted:
-        posted = await channel.send(embed=embed, view=view)
+    if posted_id is None:
+        posted_id = (await channel.send(embed=embed, view=view)).id
 
-    await db.set_dashboard(guild.id, channel.id, posted.id)
+    await db.set_dashboard(guild.id, channel.id, posted_id)
     await interaction.followup.send(f"Dashboard publié dans {channel.mention}.", ephemeral=True)
 
 @bot.tree.command(description="Définir/mettre à jour ton pseudo Dofus affiché sur ta fiche.")
 async def profil_setname(interaction: discord.Interaction, pseudo_dofus: str):
     await db.set_profile_name(interaction.guild_id, interaction.user.id, pseudo_dofus.strip())
     await interaction.response.send_message(f"Ton pseudo Dofus est maintenant **{pseudo_dofus}**.", ephemeral=True)
-    ch_id, msg_id = await db.get_dashboard(interaction.guild_id)
-    if ch_id and msg_id:
-        try:
-            ch = interaction.guild.get_channel(ch_id) or await interaction.guild.fetch_channel(ch_id)
-            msg = await ch.fetch_message(msg_id)
-            await update_dashboard_message(bot, interaction.guild, msg)  # ← passe la Guild
-        except Exception as e:
-            log.info("Refresh dashboard après profil_setname a échoué: %s", e)
+    # Rafraîchissement regroupé : une rafale de modifications = un seul rendu + edit
+    bot.refresher_for(interaction.guild_id).request(interaction.guild_id)
 
 # Liste des choix de métiers pour les menus déroulants
 METIER_CHOICES = [
@@ -428,14 +2432,8 @@ async def metier_set(
     await db.set_job(interaction.guild_id, target.id, metier, niveau)
     await interaction.response.send_message(f"{display_metier(metier)} de {target.mention} → **{niveau}**.", ephemeral=True)
 
-    ch_id, msg_id = await db.get_dashboard(interaction.guild_id)
-    if ch_id and msg_id:
-        try:
-            ch = interaction.guild.get_channel(ch_id) or await interaction.guild.fetch_channel(ch_id)
-            msg = await ch.fetch_message(msg_id)
-            await update_dashboard_message(bot, interaction.guild, msg)  # ← passe la Guild
-        except Exception as e:
-            log.info("Refresh dashboard après metier_set a échoué: %s", e)
+    # Rafraîchissement regroupé : une rafale de modifications = un seul rendu + edit
+    bot.refresher_for(interaction.guild_id).request(interaction.guild_id)
 
 @bot.tree.command(description="Retirer un métier (ex: /metier_remove paysan).")
 @app_commands.describe(metier="Choisis un métier dans la liste")
@@ -455,14 +2453,112 @@ async def metier_remove(
     await db.remove_job(interaction.guild_id, target.id, metier)
     await interaction.response.send_message(f"{display_metier(metier)} retiré pour {target.mention}.", ephemeral=True)
 
-    ch_id, msg_id = await db.get_dashboard(interaction.guild_id)
-    if ch_id and msg_id:
-        try:
-            ch = interaction.guild.get_channel(ch_id) or await interaction.guild.fetch_channel(ch_id)
-            msg = await ch.fetch_message(msg_id)
-            await update_dashboard_message(bot, interaction.guild, msg)  # ← passe la Guild
-        except Exception as e:
-            log.info("Refresh dashboard après metier_remove a échoué: %s", e)
+    # Rafraîchissement regroupé : une rafale de modifications = un seul rendu + edit
+    bot.refresher_for(interaction.guild_id).request(interaction.guild_id)
+
+_MENTION_RE = re.compile(r"^<@!?(\d+)>$")
+
+def _resolve_member_id(guild: discord.Guild, raw: str) -> int | None:
+    # Mention, id brut ou pseudo (via le cache membres, vide en mode LEAN_GATEWAY : mention ou id seulement)
+    m = _MENTION_RE.match(raw)
+    if m:
+        return int(m.group(1))
+    if raw.isdigit():
+        return int(raw)
+    member = guild.get_member_named(raw)
+    return member.id if member else None
+
+async def _absent_member_ids(guild: discord.Guild, user_ids) -> set[int]:
+    # Ids absents du serveur : cache membres d'abord, puis une requête gateway par lot de 100
+    # (vaut aussi en mode LEAN_GATEWAY : la recherche par ids ne demande pas l'intent members)
+    missing = [uid for uid in user_ids if guild.get_member(uid) is None]
+    found = set()
+    for i in range(0, len(missing), 100):
+        batch = missing[i:i + 100]
+        found.update(m.id for m in await guild.query_members(user_ids=batch, limit=len(batch), cache=False))
+    return set(missing) - found
+
+async def parse_import(guild: discord.Guild, text: str):
+    # Lignes `membre, métier, niveau` (séparateur , ; ou tabulation) -> (records dédoublonnés, erreurs)
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    levels: dict[tuple[int, str], int] = {}
+    member_lines: dict[int, list[int]] = {}  # user_id -> lignes où il apparaît
+    errors: list[tuple[int, str]] = []
+    for lineno, row in enumerate(csv.reader(io.StringIO(text), dialect), start=1):
+        row = [c.strip() for c in row]
+        if not any(row):
+            continue
+        if len(row) != 3:
+            errors.append((lineno, "3 colonnes attendues"))
+            continue
+        raw_member, raw_job, raw_level = row
+        if lineno == 1 and not raw_level.isdigit():
+            continue  # en-tête
+        job = norm(raw_job)
+        if job not in EMOJI_BY_METIER:
+            errors.append((lineno, f"métier inconnu `{raw_job}`"))
+            continue
+        if not raw_level.isdigit() or not 1 <= int(raw_level) <= 200:
+            errors.append((lineno, f"niveau invalide `{raw_level}`"))
+            continue
+        user_id = _resolve_member_id(guild, raw_member)
+        if user_id is None:
+            errors.append((lineno, f"membre introuvable `{raw_member}`"))
+            continue
+        levels[(user_id, job)] = int(raw_level)  # la dernière occurrence gagne
+        member_lines.setdefault(user_id, []).append(lineno)
+    # Id bien formé mais qui n'est pas membre (faute de frappe, membre parti) : rien n'est importé pour lui
+    absent = await _absent_member_ids(guild, member_lines) if member_lines else set()
+    for user_id in absent:
+        errors.extend((lineno, f"membre absent du serveur `{user_id}`") for lineno in member_lines[user_id])
+    records = [(uid, job, lvl) for (uid, job), lvl in levels.items() if uid not in absent]
+    return records, [f"ligne {lineno} : {msg}" for lineno, msg in sorted(errors)]
+
+@bot.tree.command(description="Importer des niveaux depuis un fichier CSV (membre, métier, niveau).")
+@app_commands.describe(fichier="Fichier CSV/texte : une ligne `membre, métier, niveau` (mention, id ou pseudo)")
+async def metier_import(interaction: discord.Interaction, fichier: discord.Attachment):
+    if not can_edit_others(interaction.user):
+        return await interaction.response.send_message("Seuls les rôles autorisés peuvent importer des métiers.", ephemeral=True)
+    if fichier.size > IMPORT_MAX_BYTES:
+        return await interaction.response.send_message(f"Fichier trop volumineux (max {IMPORT_MAX_BYTES // 1000} ko).", ephemeral=True)
+    await interaction.response.defer(thinking=True, ephemeral=True)
+    try:
+        text = (await fichier.read()).decode("utf-8-sig")
+    except UnicodeDecodeError:
+        return await interaction.followup.send("❌ Le fichier doit être encodé en UTF-8.", ephemeral=True)
+
+    records, errors = await parse_import(interaction.guild, text)
+    if records:
+        await db.import_jobs(interaction.guild_id, records)
+        # Un seul rafraîchissement pour tout l'import
+        bot.refresher_for(interaction.guild_id).request(interaction.guild_id)
+
+    members = len({uid for uid, _, _ in records})
+    msg = f"✅ **{len(records)}** niveau(x) importé(s) pour **{members}** membre(s)."
+    if errors:
+        msg += f"\n⚠️ {len(errors)} ligne(s) ignorée(s) :\n" + "\n".join(errors[:10])
+        if len(errors) > 10:
+            msg += f"\n… et {len(errors) - 10} autre(s)."
+    await interaction.followup.send(msg, ephemeral=True)
+
+@bot.tree.command(description="Exporter les métiers de la guilde (CSV compressé).")
+@app_commands.checks.has_permissions(manage_guild=True)
+async def metier_export(interaction: discord.Interaction):
+    await interaction.response.defer(thinking=True, ephemeral=True)
+    guild = interaction.guild
+    filename = f"metiers_{guild.id}.csv.gz"
+    # Flux COPY -> gzip -> fichier temporaire (en mémoire jusqu'à EXPORT_SPOOL_BYTES, sur disque au-delà)
+    with tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES) as tmp:
+        with gzip.GzipFile(filename=filename[:-3], mode="wb", fileobj=tmp) as gz:
+            await db.export_csv(guild.id, gz)
+        size = tmp.tell()
+        if size > guild.filesize_limit:
+            return await interaction.followup.send(f"❌ Export trop volumineux pour Discord ({size // 1_000_000} Mo).", ephemeral=True)
+        tmp.seek(0)
+        await interaction.followup.send("📦 Export des métiers de la guilde.", file=discord.File(tmp, filename=filename), ephemeral=True)
 
 @bot.tree.command(description="Afficher la fiche métiers d'un membre.")
 async def metier_list(interaction: discord.Interaction, membre: discord.Member | None = None):
@@ -483,19 +2579,48 @@ async def metier_list(interaction: discord.Interaction, membre: discord.Member |
 @bot.tree.command(description="Re-rendre le dashboard (si souci d’affichage).")
 @app_commands.checks.has_permissions(manage_guild=True)
 async def dashboard_refresh(interaction: discord.Interaction):
-    ch_id, msg_id = await db.get_dashboard(interaction.guild_id)
-    if not (ch_id and msg_id):
-        return await interaction.response.send_message("Dashboard non configuré. Utilise `/dashboard setchannel` dans le salon voulu.", ephemeral=True)
     await interaction.response.defer(ephemeral=True)
-    ch = interaction.guild.get_channel(ch_id) or await interaction.guild.fetch_channel(ch_id)
-    msg = await ch.fetch_message(msg_id)
-    await update_dashboard_message(bot, interaction.guild, msg)  # ← passe la Guild
+    configured = (await db.get_dashboard(interaction.guild_id))[1] is not None
+    if not await refresh_dashboard(bot, interaction.guild):
+        if configured:  # message supprimé entre-temps : refresh_dashboard vient d'effacer ses ids
+            return await interaction.followup.send("Le message du dashboard a été supprimé. Republie-le avec `/dashboard setchannel` dans le salon voulu.", ephemeral=True)
+        return await interaction.followup.send("Dashboard non configuré. Utilise `/dashboard setchannel` dans le salon voulu.", ephemeral=True)
     await interaction.followup.send("Dashboard rafraîchi.", ephemeral=True)
 
+@bot.tree.command(description="Appels lents au stockage depuis le démarrage + plan de la requête du dashboard.")
+@app_commands.checks.has_permissions(administrator=True)
+async def db_slow(interaction: discord.Interaction):
+    await interaction.response.defer(thinking=True, ephemeral=True)
+    guild_id = interaction.guild_id
+    # Appels de cette guilde (ou sans guilde : méta, pseudos groupés) ; les autres guildes ne sont pas montrées
+    lines = [
+        f"`{name}` **{elapsed * 1000:.0f} ms** (connexion {wait * 1000:.0f} ms) • {rows if rows is not None else '?'} lignes • <t:{int(at)}:R>"
+        for elapsed, _, name, gid, rows, wait, at in sorted(SLOW_QUERIES, reverse=True)
+        if gid in (guild_id, None)
+    ]
+    embed = discord.Embed(
+        title="🐢 Appels lents au stockage",
+        description="\n".join(lines[:15]) or f"*Aucun appel au-dessus de {DB_SLOW_QUERY_MS:.0f} ms depuis le démarrage.*",
+        color=discord.Color.orange()
+    )
+    means = sorted(((total / count, count, key[0]) for key, (count, total) in DB_LATENCY.summary().items() if count), reverse=True)
+    if means:
+        embed.add_field(name="Moyenne par méthode (toutes guildes)", inline=False,
+                        value="\n".join(f"`{name}` {mean * 1000:.1f} ms × {count}" for mean, count, name in means[:10]))
+    if not isinstance(db, DB):
+        embed.set_footer(text="EXPLAIN disponible uniquement avec le stockage Postgres.")
+        return await interaction.followup.send(embed=embed, ephemeral=True)
+    plans = await db.explain_roster(guild_id)
+    report = "\n\n".join(f"-- {title}\n{plan}" for title, plan in zip(("Comptage", "Page 1"), plans))
+    await interaction.followup.send(embed=embed, file=discord.File(io.BytesIO(report.encode()), filename="explain_roster.txt"), ephemeral=True)
+
 TOKEN = os.getenv("DISCORD_TOKEN") or "PUT_TOKEN_HERE"
-# Sanity log (ne pas afficher tout le token)
-t = os.getenv("DISCORD_TOKEN", "")
-print(f"[boot] token chargé: {('ok:'+t[:8]+'...') if t else 'ABSENT'}")
-print(f"[boot] DATABASE_URL présent: {'oui' if os.getenv('DATABASE_URL') else 'non'}")
 
-bot.run(TOKEN)
+# Lancement seulement en script : le module reste importable (benchmarks)
+if __name__ == "__main__":
+    # Sanity log (ne pas afficher tout le token)
+    t = os.getenv("DISCORD_TOKEN", "")
+    print(f"[boot] token chargé: {('ok:'+t[:8]+'...') if t else 'ABSENT'}")
+    print(f"[boot] DATABASE_URL présent: {'oui' if os.getenv('DATABASE_URL') else 'non'}")
+
+    bot.run(TOKEN)
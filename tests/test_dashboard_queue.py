@@ -0,0 +1,119 @@
+# EditQueue (seau à jetons par salon, dernier contenu gagnant) et DashboardRefresher (regroupement des rafraîchissements)
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+import discord
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import bot_metiers as bm  # noqa: E402
+
+class FakeMessage:
+    # discord.Message réduit à ce qu'utilise EditQueue : id, salon et edit()
+    def __init__(self, message_id: int, channel_id: int, error: Exception | None = None):
+        self.id = message_id
+        self.channel = SimpleNamespace(id=channel_id)
+        self.error = error
+        self.edits: list[tuple[float, dict]] = []
+
+    async def edit(self, **kwargs):
+        self.edits.append((asyncio.get_running_loop().time(), kwargs))
+        if self.error is not None:
+            raise self.error
+
+def test_latest_edit_wins():
+    async def run():
+        queue = bm.EditQueue(rate=5, per=5)
+        message = FakeMessage(1, 10)
+        sent = await asyncio.gather(*(queue.edit(message, content=i) for i in range(6)))
+        return queue, message, sent
+
+    queue, message, sent = asyncio.run(run())
+    assert sent == [False] * 5 + [True]
+    assert [kwargs for _, kwargs in message.edits] == [{"content": 5}]
+    assert queue.superseded == 5
+
+def test_edits_are_paced_per_channel():
+    async def run():
+        queue = bm.EditQueue(rate=2, per=0.2)
+        same = [FakeMessage(i, 10) for i in range(3)]
+        other = FakeMessage(99, 20)
+        start = asyncio.get_running_loop().time()
+        await asyncio.gather(*(queue.edit(m, content="x") for m in same + [other]))
+        return [m.edits[0][0] - start for m in same], other.edits[0][0] - start
+
+    same, other = asyncio.run(run())
+    # 2 jetons d'avance, puis un jeton toutes les per/rate = 0,1 s
+    assert same[0] < 0.05 and same[1] < 0.05
+    assert same[2] >= 0.09
+    assert other < 0.05  # un autre salon a son propre seau
+
+def test_edit_errors_reach_the_caller():
+    not_found = discord.NotFound(SimpleNamespace(status=404, reason="Not Found"), "Unknown Message")
+
+    async def run():
+        queue = bm.EditQueue(rate=5, per=5)
+        with pytest.raises(discord.NotFound):
+            await queue.edit(FakeMessage(1, 10, error=not_found), content="x")
+        assert await queue.edit(FakeMessage(2, 10), content="y")  # la file reste utilisable
+
+    asyncio.run(run())
+
+def test_idle_buckets_are_evicted():
+    async def run():
+        queue = bm.EditQueue(rate=5, per=0.05)
+        await queue.edit(FakeMessage(1, 10), content="x")
+        await asyncio.sleep(0.06)
+        await queue.edit(FakeMessage(2, 20), content="x")
+        return set(queue._buckets)
+
+    assert asyncio.run(run()) == {20}
+
+@pytest.fixture
+def refreshes(monkeypatch):
+    # refresh_dashboard remplacé : (instant, guild_id) de chaque rafraîchissement réellement lancé
+    calls = []
+
+    async def fake_refresh(bot, guild):
+        calls.append((asyncio.get_running_loop().time(), guild.id))
+        return True
+
+    monkeypatch.setattr(bm, "refresh_dashboard", fake_refresh)
+    return calls
+
+def fake_bot():
+    return SimpleNamespace(get_guild=lambda guild_id: SimpleNamespace(id=guild_id))
+
+def test_refresher_debounces_a_burst(refreshes):
+    async def run():
+        refresher = bm.DashboardRefresher(fake_bot(), debounce=0.05, max_delay=1)
+        start = asyncio.get_running_loop().time()
+        for _ in range(10):
+            refresher.request(1)
+            await asyncio.sleep(0.01)
+        refresher.request(2)
+        await asyncio.sleep(0.2)
+        return start
+
+    start = asyncio.run(run())
+    assert sorted(guild_id for _, guild_id in refreshes) == [1, 2]
+    first = next(t for t, guild_id in refreshes if guild_id == 1)
+    assert first - start >= 0.09 + 0.05 - 0.01  # dernière demande + debounce
+
+def test_refresher_max_delay_bounds_a_steady_stream(refreshes):
+    async def run():
+        refresher = bm.DashboardRefresher(fake_bot(), debounce=0.05, max_delay=0.15)
+        start = asyncio.get_running_loop().time()
+        while asyncio.get_running_loop().time() - start < 0.4:
+            refresher.request(1)
+            await asyncio.sleep(0.02)
+        await asyncio.sleep(0.1)
+        return start
+
+    start = asyncio.run(run())
+    # Demandes toutes les 20 ms, jamais 50 ms de calme : seul max_delay déclenche pendant le flux
+    assert len(refreshes) >= 2
+    assert 0.15 <= refreshes[0][0] - start < 0.25
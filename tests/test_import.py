@@ -0,0 +1,77 @@
+# parse_import : lecture des fichiers de /metier_import (séparateurs, en-tête, doublons, bornes, membres)
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import bot_metiers as bm  # noqa: E402
+
+class FakeMember:
+    def __init__(self, user_id: int, name: str):
+        self.id = user_id
+        self.name = name
+
+class FakeGuild:
+    # Ce que parse_import lit d'une discord.Guild : cache membres et recherche gateway par ids
+    def __init__(self, cached: dict[int, str], remote: dict[int, str] | None = None):
+        self.cached = {uid: FakeMember(uid, name) for uid, name in cached.items()}
+        self.remote = {uid: FakeMember(uid, name) for uid, name in (remote or {}).items()}
+        self.queries: list[list[int]] = []
+
+    def get_member(self, user_id: int):
+        return self.cached.get(user_id)
+
+    def get_member_named(self, name: str):
+        return next((m for m in self.cached.values() if m.name == name), None)
+
+    async def query_members(self, *, user_ids, limit, cache):
+        self.queries.append(list(user_ids))
+        return [self.remote[uid] for uid in user_ids if uid in self.remote]
+
+def parse(guild, text):
+    return asyncio.run(bm.parse_import(guild, text))
+
+GUILD_MEMBERS = {111: "alice", 222: "bob"}
+
+def test_header_and_delimiters():
+    guild = FakeGuild(GUILD_MEMBERS)
+    for text in ("membre,métier,niveau\n111,Paysan,120\n", "membre;métier;niveau\n111;paysan;120\n",
+                 "membre\tmétier\tniveau\n111\tpaysan\t120\n"):
+        assert parse(guild, text) == ([(111, "paysan", 120)], [])
+
+def test_mentions_ids_and_names():
+    records, errors = parse(FakeGuild(GUILD_MEMBERS), "<@111>,mineur,10\n<@!222>,mineur,20\nbob,Bûcheron,30\n")
+    assert errors == []
+    assert records == [(111, "mineur", 10), (222, "mineur", 20), (222, "bucheron", 30)]
+
+def test_duplicates_keep_last_line():
+    records, _ = parse(FakeGuild(GUILD_MEMBERS), "111,mineur,10\n111,Mineur,50\n")
+    assert records == [(111, "mineur", 50)]
+
+def test_invalid_lines_are_reported():
+    text = "111,mineur,0\n111,mineur,201\n111,jardinier,10\n111,mineur\ncarole,mineur,10\n\n111,mineur,abc\n"
+    records, errors = parse(FakeGuild(GUILD_MEMBERS), text)
+    assert records == []
+    assert errors == [
+        "ligne 1 : niveau invalide `0`",
+        "ligne 2 : niveau invalide `201`",
+        "ligne 3 : métier inconnu `jardinier`",
+        "ligne 4 : 3 colonnes attendues",
+        "ligne 5 : membre introuvable `carole`",
+        "ligne 7 : niveau invalide `abc`",
+    ]
+
+def test_ids_outside_the_guild_are_rejected():
+    # 333 n'est pas en cache (mode LEAN_GATEWAY) mais bien membre ; 50 est une faute de frappe
+    guild = FakeGuild(GUILD_MEMBERS, remote={333: "carole"})
+    records, errors = parse(guild, "111,paysan,120\n50,paysan,120\n333,paysan,80\n50,mineur,3\n")
+    assert records == [(111, "paysan", 120), (333, "paysan", 80)]
+    assert errors == ["ligne 2 : membre absent du serveur `50`", "ligne 4 : membre absent du serveur `50`"]
+    assert guild.queries == [[50, 333]]
+
+def test_member_lookup_is_batched():
+    guild = FakeGuild({}, remote={uid: f"m{uid}" for uid in range(1000, 1250)})
+    records, errors = parse(guild, "".join(f"{uid},mineur,1\n" for uid in range(1000, 1250)))
+    assert (len(records), errors) == (250, [])
+    assert [len(q) for q in guild.queries] == [100, 100, 50]
@@ -0,0 +1,188 @@
+# Vérifications communes à tous les stockages (Storage) : mêmes appels, mêmes résultats attendus.
+# Stockages testés : mémoire, SQLite (fichier temporaire, si aiosqlite est installé) et Postgres "rows" / "wide"
+# si TEST_DATABASE_URL / TEST_DATABASE_URL_WIDE sont définies (deux bases distinctes : "wide" vide `jobs`).
+# Côté Postgres, migrations appliquées et données écrites sous un guild_id tiré au hasard puis supprimées.
+# Usage :
+#   python -m pytest tests
+import asyncio
+import gzip
+import io
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import bot_metiers as bm  # noqa: E402
+
+CHECKS = []
+
+def check(func):
+    CHECKS.append(func)
+    return func
+
+def expect(got, want, what: str):
+    if got != want:
+        raise AssertionError(f"{what} : obtenu {got!r}, attendu {want!r}")
+
+@check
+async def jobs_are_normalized_and_sorted(s, g):
+    await s.set_job(g, 1, "Bûcheron", 40)
+    await s.set_job(g, 1, "alchimiste", 100)
+    await s.set_job(g, 1, "mineur", 40)
+    await s.set_job(g, 1, "bucheron", 50)  # même métier, niveau remplacé
+    expect(await s.list_user_jobs(g, 1), [("alchimiste", 100), ("bucheron", 50), ("mineur", 40)], "list_user_jobs")
+    await s.remove_job(g, 1, "Mineur")
+    expect(await s.list_user_jobs(g, 1), [("alchimiste", 100), ("bucheron", 50)], "après remove_job")
+    expect(await s.list_user_jobs(g, 2), [], "membre inconnu")
+
+@check
+async def profile_names(s, g):
+    expect(await s.get_profile_name(g, 1), None, "pseudo absent")
+    await s.set_profile_name(g, 1, "Perso")
+    await s.set_profile_name(g, 1, "Perso2")
+    expect(await s.get_profile_name(g, 1), "Perso2", "pseudo Dofus")
+
+@check
+async def roster_is_ranked_by_average(s, g):
+    await s.set_job(g, 3, "paysan", 10)
+    await s.set_job(g, 1, "paysan", 60)
+    await s.set_job(g, 1, "mineur", 20)
+    await s.set_job(g, 2, "forgeron", 40)
+    await s.set_profile_name(g, 2, "Forgeux")
+    expect(await s.roster(g), [
+        (1, None, None, [("paysan", 60), ("mineur", 20)], 40.0),
+        (2, None, "Forgeux", [("forgeron", 40)], 40.0),
+        (3, None, None, [("paysan", 10)], 10.0),
+    ], "roster")
+
+@check
+async def pages_and_filters(s, g):
+    for uid in range(1, 14):
+        await s.set_job(g, uid, "chasseur", uid)
+        if uid % 2:
+            await s.set_job(g, uid, "tailleur", 200 - uid)
+    chunk, total, page = await s.roster_page(g, 0, None, per_page=6)
+    # Impairs : moyenne 100 (ex æquo, départagés par user_id) ; pairs : moyenne = user_id
+    expect((total, page, [c[0] for c in chunk]), (13, 0, [1, 3, 5, 7, 9, 11]), "page 1 sans filtre")
+    expect(chunk[0][3], [("tailleur", 199), ("chasseur", 1)], "métiers d'une carte")
+    chunk, total, page = await s.roster_page(g, 99, None, per_page=6)
+    expect((total, page, [c[0] for c in chunk]), (13, 2, [2]), "page hors bornes ramenée à la dernière")
+    chunk, total, page = await s.roster_page(g, 0, "tailleur", per_page=6)
+    expect((total, [(c[0], c[3]) for c in chunk][:2]), (7, [(1, [("tailleur", 199)]), (3, [("tailleur", 197)])]), "filtre")
+    expect(chunk[0][4], 100.0, "moyenne tous métiers confondus sous filtre")
+    expect(await s.roster_page(g, 0, "bricoleur", per_page=6), ([], 0, 0), "filtre sans membre")
+
+@check
+async def writes_invalidate_cache(s, g):
+    await s.set_job(g, 1, "pecheur", 10)
+    expect((await s.roster_page(g))[1], 1, "avant écriture")
+    await s.set_job(g, 2, "pecheur", 20)
+    chunk, total, _ = await s.roster_page(g)
+    expect((total, chunk[0][0]), (2, 2), "après écriture")
+    await s.remove_job(g, 2, "pecheur")
+    expect((await s.roster_page(g))[1], 1, "après suppression")
+
+@check
+async def import_merges(s, g):
+    await s.set_job(g, 1, "mineur", 10)
+    await s.set_job(g, 1, "paysan", 30)
+    await s.import_jobs(g, [(1, "mineur", 90), (2, "forgeron", 5)])
+    expect(await s.list_user_jobs(g, 1), [("mineur", 90), ("paysan", 30)], "import : métier remplacé, autre gardé")
+    expect(await s.list_user_jobs(g, 2), [("forgeron", 5)], "import : nouveau membre")
+
+@check
+async def display_names(s, g):
+    await s.set_job(g, 1, "mineur", 10)
+    await s.set_display_names([(g, 1, "Alice"), (g, 2, "Bob")])  # 2 n'a aucun métier
+    chunk, total, _ = await s.roster_page(g)
+    expect((total, chunk[0][1]), (1, "Alice"), "pseudo Discord dans la page")
+    await s.set_display_names([(g, 1, "Alice2")])
+    expect((await s.roster(g))[0][1], "Alice2", "pseudo Discord mis à jour")
+    await s.set_job(g, 2, "mineur", 5)
+    expect((await s.roster(g))[1][1], None, "pseudo d'un membre sans métier non enregistré")
+
+@check
+async def csv_export(s, g):
+    await s.set_job(g, 2, "mineur", 10)
+    await s.set_job(g, 1, "paysan", 30)
+    await s.set_job(g, 1, "alchimiste", 20)
+    await s.set_profile_name(g, 1, "Perso")
+    buf = io.BytesIO()
+    with gzip.GzipFile(mode="wb", fileobj=buf) as gz:
+        await s.export_csv(g, gz)
+    text = gzip.decompress(buf.getvalue()).decode()
+    expect(text.splitlines(), ["user_id,dofus_name,job_name,level", "1,Perso,alchimiste,20", "1,Perso,paysan,30", "2,,mineur,10"], "CSV")
+
+@check
+async def meta_and_dashboard(s, g):
+    key = f"check:{g}"
+    expect(await s.get_meta(key), None, "méta absente")
+    await s.set_meta(key, "a")
+    await s.set_meta(key, "b")
+    expect(await s.get_meta(key), "b", "méta")
+    expect(await s.get_dashboard(g), (None, None), "dashboard absent")
+    await s.set_dashboard(g, 10, 20)
+    expect(await s.get_dashboard(g), (10, 20), "dashboard")
+    await s.forget_dashboard(g)
+    expect(await s.get_dashboard(g), (None, None), "dashboard oublié")
+    s._dashboards.clear()  # comme après un redémarrage : relu depuis le stockage
+    expect(await s.get_dashboard(g), (None, None), "dashboard oublié en base")
+
+async def cleanup_postgres(s, guild_id: int):
+    async with s._acquire() as conn:
+        for table in ("jobs", "profiles", "settings"):
+            await conn.execute(f"DELETE FROM {table} WHERE guild_id=$1", guild_id)
+        await conn.execute("DELETE FROM bot_meta WHERE key=$1", f"check:{guild_id}")
+
+def _postgres(layout: str, env: str):
+    dsn = os.getenv(env)
+    marks = () if dsn else pytest.mark.skip(reason=f"{env} non définie")
+    return pytest.param(lambda tmp_path: (bm.WideDB if layout == "wide" else bm.DB)(dsn), id=f"postgres-{layout}", marks=marks)
+
+BACKENDS = [
+    pytest.param(lambda tmp_path: bm.MemoryStorage(), id="memory"),
+    pytest.param(lambda tmp_path: bm.SqliteStorage(str(tmp_path / "check.db")), id="sqlite",
+                 marks=() if bm.aiosqlite else pytest.mark.skip(reason="aiosqlite absent")),
+    _postgres("rows", "TEST_DATABASE_URL"),
+    _postgres("wide", "TEST_DATABASE_URL_WIDE"),
+]
+
+@pytest.mark.parametrize("check", CHECKS, ids=lambda f: f.__name__)
+@pytest.mark.parametrize("make_storage", BACKENDS)
+def test_storage(make_storage, check, tmp_path):
+    storage = make_storage(tmp_path)
+    # Une guilde neuve par vérification : elles sont indépendantes et n'ont rien à nettoyer entre elles
+    guild_id = random.randrange(1 << 40, 1 << 50)
+
+    async def run():
+        await storage.setup()
+        try:
+            await check(storage, guild_id)
+        finally:
+            if isinstance(storage, bm.DB):
+                await cleanup_postgres(storage, guild_id)
+            await storage.close()
+
+    asyncio.run(run())
+
+def test_storage_is_abstract():
+    with pytest.raises(TypeError):
+        bm.Storage()
+
+@pytest.mark.skipif(not os.getenv("TEST_DATABASE_URL_WIDE"), reason="TEST_DATABASE_URL_WIDE non définie")
+def test_rows_layout_refuses_wide_database():
+    async def run():
+        wide = bm.WideDB(os.environ["TEST_DATABASE_URL_WIDE"])
+        await wide.setup()
+        await wide.close()
+        storage = bm.DB(os.environ["TEST_DATABASE_URL_WIDE"])
+        try:
+            with pytest.raises(RuntimeError, match="STORAGE_LAYOUT"):
+                await storage.setup()
+        finally:
+            await storage.close()
+
+    asyncio.run(run())